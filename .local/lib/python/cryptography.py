@@ -1,8 +1,52 @@
+"""Public-key cryptosystems and integer factorization built on the routines
+in numbertheory."""
+
+from binascii import hexlify, unhexlify
+from collections import OrderedDict
+from itertools import chain, compress, islice, izip, repeat
+from multiprocessing import Pool, cpu_count
+from numbertheory import FixedBasePower, batch_gcd, batch_gcd_on_disk, \
+                         batch_inverse, chunked, gcd, inversemod, is_prime, \
+                         jacobi, lcm_to, map_batched, montgomery_multiply, \
+                         powermod, primes, sqrtmod_many, suyama_curve, \
+                         _time_each
+from os import urandom
+from random import randrange, seed, shuffle
+import struct
+
 ##################################################
 ## The Diffie-Hellman Key Exchange
 ##################################################
 
-def random_prime(num_digits, is_prime = miller_rabin):
+# Odd primes whose multiples sieve_candidates strikes out, the first few
+# thousand.  Candidates that survive them are prime about ten times as often
+# as odd numbers in general.
+SIEVE_PRIMES = primes(1 << 15)[1:]
+
+# Number of odd candidates the random prime generators sieve at a time.
+PRIME_WINDOW_SIZE = 1 << 12
+
+# Windows each task searches when generating primes on a pool of workers.
+PRIME_WINDOWS_PER_TASK = 4
+
+# Number of primes whose tables of powers of 2 dh_init keeps.
+DH_POWER_CACHE_SIZE = 8
+
+# The 2048-bit MODP group of RFC 3526, a safe prime with generator 2.
+RFC3526_PRIME = long(
+    "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD1"
+    "29024E088A67CC74020BBEA63B139B22514A08798E3404DD"
+    "EF9519B3CD3A431B302B0A6DF25F14374FE1356D6D51C245"
+    "E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+    "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3D"
+    "C2007CB8A163BF0598DA48361C55D39A69163FA8FD24CF5F"
+    "83655D23DCA3AD961C62F356208552BB9ED529077096966D"
+    "670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+    "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9"
+    "DE2BCBF6955817183995497CEA956AE515D2261898FA0510"
+    "15728E5A8AACAA68FFFFFFFFFFFFFFFF", 16)
+
+def random_prime(num_digits, is_prime = is_prime):
     """
     Returns a random prime with num_digits digits.
     Input:
@@ -19,19 +63,165 @@ def random_prime(num_digits, is_prime = miller_rabin):
     >>> random_prime(40)
     1311696770583281776596904119734399028761L  #rand
     """
-    n = randrange(10**(num_digits-1), 10**num_digits)
-    if n % 2 == 0:
-        n += 1
-    while not is_prime(n):
-        n += 2
-    return n
+    return _random_prime(10**(num_digits-1), 10**num_digits, is_prime)
+
+def random_prime_bits(bits, safe=False, strong=False, workers=None):
+    """
+    Returns a random prime of exactly the given number of
+    bits.  Windows of candidates are sieved by
+    sieve_candidates, and only the survivors, taken in
+    random order, are tested with is_prime.
+    Input:
+        bits -- an integer, at least 2 (at least 3 for
+                safe primes, 64 for strong primes)
+        safe -- (optional) if true, a safe prime
+                p = 2q + 1 with q prime, as used for
+                Diffie-Hellman groups
+        strong -- (optional) if true, a strong prime by
+                Gordon's algorithm: p - 1 has a large prime
+                factor r, r - 1 has a large prime factor,
+                and p + 1 has a large prime factor
+        workers -- (optional) a number of processes to
+                search on, or 0 for one per CPU
+    Output:
+        int -- a prime
+    Examples:
+    >>> random_prime_bits(64, safe=True)
+    17004400296366880719L    #rand
+    """
+    assert not (safe and strong), "choose safe or strong primes."
+    assert bits >= (3 if safe else 2), "no prime has so few bits."
+    if strong:
+        assert bits >= 64, "strong primes need at least 64 bits."
+        return _strong_prime(bits)
+    if workers is None:
+        return _random_prime(1 << (bits - 1), 1 << bits, is_prime, safe)
+    # Reseed each process, or the forked searches would all be identical.
+    workers = workers or cpu_count()
+    pool = Pool(workers, initializer=seed)
+    try:
+        # Hand out tasks in rounds until one of them finds a prime.
+        while True:
+            tasks = repeat((bits, safe), 4 * workers)
+            for p in pool.imap_unordered(_search_prime_windows, tasks):
+                if p is not None:
+                    return p
+    finally:
+        pool.terminate()
+        pool.join()
+
+def sieve_candidates(start, size, safe=False):
+    """
+    Returns the numbers among the odd numbers start,
+    start + 2, ..., start + 2*(size-1) that have no prime
+    factor in SIEVE_PRIMES other than themselves, struck
+    out of a bytearray of offsets a prime at a time.
+    Input:
+        start -- an odd integer
+        size -- a nonnegative integer
+        safe -- (optional) if true, also strike out every
+                n for which (n - 1)/2 has such a factor
+    Output:
+        list -- a list of integers
+    Examples:
+    >>> sieve_candidates(101, 10)
+    [101, 103, 107, 109, 113]
+    """
+    assert start % 2 == 1, "start must be odd."
+    flags = bytearray([1]) * size
+    for p in SIEVE_PRIMES:
+        # start + 2*i is divisible by p for i = -start/2 mod p.
+        first = -start * ((p + 1) / 2) % p
+        if start + 2 * first == p:
+            first += p
+        if first < size:
+            flags[first::p] = bytearray((size - 1 - first) / p + 1)
+        if safe:
+            # and (start + 2*i - 1)/2 for i = (1 - start)/2 mod p.
+            first = (1 - start) * ((p + 1) / 2) % p
+            if start + 2 * first == 2 * p + 1:
+                first += p
+            if first < size:
+                flags[first::p] = bytearray((size - 1 - first) / p + 1)
+    return [start + 2 * i for i in compress(xrange(size), flags)]
+
+def _random_prime(lo, hi, is_prime, safe=False, windows=None):
+    """A random prime, or safe prime, between lo and hi - 1, found by
+    sieving random windows of candidates.  Gives up and returns None after
+    the given number of windows, if one is given."""
+    span = (hi - lo) / 2
+    size = min(PRIME_WINDOW_SIZE, span)
+    while windows is None or windows > 0:
+        start = (lo + 2 * randrange(span - size + 1)) | 1
+        candidates = sieve_candidates(start, size, safe)
+        shuffle(candidates)
+        for n in candidates:
+            if lo <= n < hi and is_prime(n) and \
+               (not safe or is_prime((n - 1) / 2)):
+                return n
+        if windows is not None:
+            windows -= 1
+
+def _search_prime_windows(task):
+    """Search a few windows for random_prime_bits in a worker process.  The
+    task is the pair (bits, safe)."""
+    bits, safe = task
+    return _random_prime(1 << (bits - 1), 1 << bits, is_prime, safe,
+                         PRIME_WINDOWS_PER_TASK)
+
+def _strong_prime(bits):
+    """A strong prime of the given number of bits, by Gordon's algorithm.
+    s and t have at least 16 bits, and 2*r*s at most bits - 15, so that
+    there is room for the multiples j."""
+    s = random_prime_bits(max(16, bits / 2 - 16))
+    t = random_prime_bits(max(16, bits / 2 - 32))
+    # r = 2*i*t + 1 prime, so t divides r - 1.
+    i = randrange(1 << 14, 1 << 15)
+    while not is_prime(2 * i * t + 1) or 2 * i * t + 1 == s:
+        i += 1
+    r = 2 * i * t + 1
+    # p0 is 1 mod r and -1 mod s, and so is p0 + 2*j*r*s.
+    p0 = 2 * powermod(s, r - 2, r) * s - 1
+    step = 2 * r * s
+    while True:
+        j = randrange(((1 << (bits - 1)) - p0) / step + 1,
+                      ((1 << bits) - p0) / step)
+        while p0 + j * step < 1 << bits:
+            if is_prime(p0 + j * step):
+                return p0 + j * step
+            j += 1
+
+def dh_group(bits=None):
+    """
+    Returns a safe prime p for Diffie-Hellman key
+    exchange with generator 2: by default the 2048-bit
+    group of RFC 3526, otherwise a random safe prime of
+    the given number of bits, generated once per process
+    and then reused.
+    Input:
+        bits -- (optional) a positive integer
+    Output:
+        int -- a safe prime
+    Examples:
+    >>> dh_group() == RFC3526_PRIME
+    True
+    """
+    if bits is None:
+        return RFC3526_PRIME
+    if bits not in _dh_groups:
+        _dh_groups[bits] = random_prime_bits(bits, safe=True)
+    return _dh_groups[bits]
+
+# Safe primes dh_group has generated, by size.
+_dh_groups = {}
 
-def dh_init(p):
+def dh_init(p=None):
     """
     Generates and returns a random positive
     integer n < p and the power 2^n (mod p).
     Input:
-        p -- an integer that is prime
+        p -- (optional) an integer that is prime, by
+             default the safe prime of dh_group()
     Output:
         int -- a positive integer < p,  a secret
         int -- 2^n (mod p), send to other user
@@ -40,8 +230,21 @@ def dh_init(p):
     >>> dh_init(p)
     (15299007531923218813L, 4715333264598442112L)   #rand
     """
+    if p is None:
+        p = dh_group()
     n = randrange(2, p)
-    return n, powermod(2, n, p)
+    try:
+        power = _dh_powers.pop(p)
+    except KeyError:
+        power = FixedBasePower(2, p)
+        if len(_dh_powers) >= DH_POWER_CACHE_SIZE:
+            _dh_powers.popitem(last=False)
+    _dh_powers[p] = power
+    return n, power(n)
+
+# Tables of powers of 2 for the primes dh_init was last called with, most
+# recently used last.
+_dh_powers = OrderedDict()
 
 def dh_secret(p, n, mpow):
     """
@@ -67,6 +270,9 @@ def dh_secret(p, n, mpow):
 ## Encoding Strings as Lists of Integers
 ##################################################
 
+# Bytes read at a time by encode_stream.
+STREAM_CHUNK_SIZE = 1 << 16
+
 def str_to_numlist(s, bound):
     """
     Returns a sequence of integers between 0 and bound-1
@@ -74,35 +280,18 @@ def str_to_numlist(s, bound):
     so the same string is very likely to encode differently
     each time this function is called.
     Input:
-        s -- a string
+        s -- a string (or any buffer of bytes)
         bound -- an integer >= 256
     Output:
         list -- encoding of s as a list of integers
     Examples:
     >>> str_to_numlist("Run!", 1000)
-    [82, 117, 110, 33]               #rand
+    [82, 117, 110, 33, 1]               #rand
     >>> str_to_numlist("TOP SECRET", 10**20)
-    [4995371940984439512L, 92656709616492L]   #rand
+    [6075156570213138559L, 5422319950133330227L]   #rand
     """
-    assert bound >= 256, "bound must be at least 256."
-    n = int(log(bound) / log(256))          # (1)
-    salt = min(int(n/8) + 1, n-1)           # (2)
-    i = 0
-    v = []
-    while i < len(s):                       # (3)
-        c = 0
-        power = 1
-        for j in range(n):                  # (4)
-            if j < salt:
-                c += randrange(1, 256)*power   # (5)
-            else:
-                if i >= len(s):
-                    break
-                c += ord(s[i])*power          # (6)
-                i += 1
-            power *= 256
-        v.append(c)
-    return v
+    data_size, salt_size = _block_layout(bound)
+    return _encode_blocks(_pad(str(s), data_size), data_size, salt_size)
 
 def numlist_to_str(v, bound):
     """
@@ -114,23 +303,130 @@ def numlist_to_str(v, bound):
     Output:
         str -- decoding of v as a string
     Examples:
-    >>> print numlist_to_str([82, 117, 110, 33], 1000)
+    >>> print numlist_to_str([82, 117, 110, 33, 1], 1000)
     Run!
     >>> x = str_to_numlist("TOP SECRET MESSAGE", 10**20)
     >>> print numlist_to_str(x, 10**20)
     TOP SECRET MESSAGE
     """
+    data_size, salt_size = _block_layout(bound)
+    return _unpad(_decode_blocks(v, data_size, salt_size))
+
+def encode_stream(stream, bound, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Generate the encoding of everything read from the
+    file-like object stream, as str_to_numlist would
+    encode it, reading roughly chunk_size bytes at a
+    time.
+    Input:
+        stream -- an object with a read method
+        bound -- an integer >= 256
+        chunk_size -- (optional) a positive integer
+    Output:
+        generator -- integers between 0 and bound-1
+    """
+    data_size, salt_size = _block_layout(bound)
+    chunk_size = max(chunk_size / data_size, 1) * data_size
+    chunk = _read_fully(stream, chunk_size)
+    while True:
+        following = _read_fully(stream, chunk_size)
+        if not following:
+            break
+        for x in _encode_blocks(chunk, data_size, salt_size):
+            yield x
+        chunk = following
+    for x in _encode_blocks(_pad(chunk, data_size), data_size, salt_size):
+        yield x
+
+def decode_stream(numbers, bound, stream, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Decode the integers produced by encode_stream or
+    str_to_numlist, writing the bytes to the file-like
+    object stream as they are decoded.
+    Input:
+        numbers -- an iterable of integers
+        bound -- an integer >= 256
+        stream -- an object with a write method
+        chunk_size -- (optional) roughly how many bytes
+                      to decode at a time
+    """
+    data_size, salt_size = _block_layout(bound)
+    blocks = max(chunk_size / data_size, 1)
+    numbers = iter(numbers)
+    pending = ""
+    while True:
+        group = list(islice(numbers, blocks))
+        if not group:
+            break
+        if pending:
+            stream.write(pending)
+        data = _decode_blocks(group, data_size, salt_size)
+        # The padding may reach back into the last block but one.
+        stream.write(data[:-2 * data_size])
+        pending = data[-2 * data_size:]
+    stream.write(_unpad(pending))
+
+def _block_layout(bound):
+    """The number of message bytes and of random salt bytes in each block of
+    an encoding for integers below bound.  Each block fills the largest
+    number of whole bytes whose values all lie below bound."""
     assert bound >= 256, "bound must be at least 256."
-    n = int(log(bound) / log(256))
-    s = ""
+    n = (bound.bit_length() - 1) / 8
     salt = min(int(n/8) + 1, n-1)
-    for x in v:
-        for j in range(n):
-            y = x % 256
-            if y > 0 and j >= salt:
-                s += chr(y)
-            x /= 256
-    return s
+    return n - salt, salt
+
+def _decode_blocks(numbers, data_size, salt_size):
+    """The message bytes of each of the encoded integers, concatenated."""
+    bits = 8 * (data_size + salt_size)
+    width = 2 * (data_size + salt_size)
+    text = 2 * data_size
+    blocks = []
+    for x in numbers:
+        if x < 0 or x >> bits:
+            raise ValueError("Encoded block out of range.")
+        blocks.append(("%0*x" % (width, x))[:text])
+    return unhexlify("".join(blocks))
+
+def _encode_blocks(data, data_size, salt_size):
+    """Encode data, whose length is a multiple of data_size, as integers:
+    data_size message bytes followed by salt_size random bytes, read as one
+    big-endian number.  The message and all the salt are hex-encoded in bulk,
+    so each block costs only a slice and an int()."""
+    blocks = len(data) / data_size
+    data = hexlify(data)
+    salt = hexlify(urandom(blocks * salt_size))
+    text = 2 * data_size
+    width = 2 * salt_size
+    return [int(data[i*text:(i+1)*text] + salt[i*width:(i+1)*width], 16)
+            for i in xrange(blocks)]
+
+def _read_fully(stream, size):
+    """Read size bytes from stream, or all that is left if it ends first.
+    A pipe or socket may return fewer bytes than asked for on each read."""
+    data = stream.read(size)
+    if len(data) in (0, size):
+        return data
+    parts = [data]
+    size -= len(data)
+    while size > 0:
+        data = stream.read(size)
+        if not data:
+            break
+        parts.append(data)
+        size -= len(data)
+    return "".join(parts)
+
+def _pad(data, data_size):
+    """Append a 0x01 byte and then zeros up to a multiple of data_size, so
+    that the end of the message can be found even if it ends in zeros."""
+    return data + "\x01" + "\x00" * (-(len(data) + 1) % data_size)
+
+def _unpad(data):
+    """Remove the padding added by _pad."""
+    data = data.rstrip("\x00")
+    if not data.endswith("\x01"):
+        raise ValueError("Missing end-of-message marker.")
+    return data[:-1]
 
 ##################################################
 ## The RSA Cryptosystem
@@ -150,7 +446,9 @@ def rsa_init(p, q):
         e -- an encryption key, which is a randomly
              chosen integer between 2 and m-1
         d -- the inverse of e modulo eulerphi(p*q),
-             as an integer between 2 and m-1
+             as an integer between 2 and m-1.  It is
+             an RSAPrivateKey, so it also carries p
+             and q for decryption by the CRT.
         n -- the product p*q.
     Examples:
     >>> p = random_prime(20); q = random_prime(20)
@@ -168,7 +466,7 @@ def rsa_init(p, q):
     e = 3
     while gcd(e, m) != 1:
         e += 1
-    d = inversemod(e, m)
+    d = RSAPrivateKey(inversemod(e, m), p, q)
     return e, d, p*q
 
 def rsa_encrypt(plain_text, e, n):
@@ -204,20 +502,327 @@ def rsa_decrypt(cipher, d, n):
     Examples:
     >>> d = 938164637865370078346033914094246201579
     >>> n = 2109029637390047474920932660992586706589
-    >>> msg1 = [1071099761433836971832061585353925961069]
-    >>> msg2 = [1336506586627416245118258421225335020977]
+    >>> msg1 = [1242828552005735308978807942056907719928]
+    >>> msg2 = [1696103398612400182833288771324519027123]
     >>> rsa_decrypt(msg1, d, n)
     'Run Nikita!'
     >>> rsa_decrypt(msg2, d, n)
     'Run Nikita!'
     """
-    plain = [powermod(x, d, n) for x in cipher]
-    return numlist_to_str(plain, n)
+    return numlist_to_str(rsa_power(cipher, d, n), n)
+
+def rsa_power(numbers, d, n):
+    """
+    Raise each of the numbers to the power d modulo n.
+    If d is an RSAPrivateKey, each power is computed
+    modulo p and q with the half-size exponents dP and
+    dQ, and the two halves of the whole list are then
+    recombined by Garner's formula, which is about four
+    times faster than working modulo n.
+    Input:
+        numbers -- list of integers between 0 and n-1
+        d -- an integer or RSAPrivateKey, the exponent
+        n -- an integer, the modulus
+    Output:
+        list -- the powers, between 0 and n-1
+    """
+    if not isinstance(d, RSAPrivateKey):
+        return [powermod(x, d, n) for x in numbers]
+    p, q, qInv = d.p, d.q, d.qInv
+    mod_p = [pow(x, d.dP, p) for x in numbers]
+    mod_q = [pow(x, d.dQ, q) for x in numbers]
+    return [b + (a - b) * qInv % p * q for a, b in zip(mod_p, mod_q)]
+
+def rsa_sign(plain_text, d, n):
+    """
+    Sign plain_text with the decryption exponent d and
+    modulus n.  The message can be recovered from the
+    signature by rsa_verify with the encryption
+    exponent.
+    Input:
+        plain_text -- arbitrary string
+        d -- an integer or RSAPrivateKey
+        n -- an integer, the modulus
+    Output:
+        list -- the signature, as a list of integers
+    """
+    return rsa_power(str_to_numlist(plain_text, n), d, n)
+
+def rsa_verify(signature, e, n):
+    """
+    Recover the message signed by rsa_sign, using the
+    encryption exponent e and modulus n.
+    Input:
+        signature -- list of integers output by rsa_sign
+        e -- an integer, the encryption exponent
+        n -- an integer, the modulus
+    Output:
+        str -- the signed plain text
+    """
+    return numlist_to_str([powermod(x, e, n) for x in signature], n)
+
+class RSAPrivateKey(long):
+    """An RSA decryption exponent d, usable anywhere the plain integer is,
+    that also keeps the primes p and q, the exponents dP = d mod (p-1) and
+    dQ = d mod (q-1), and qInv, the inverse of q modulo p.  rsa_power uses
+    these to decrypt and sign by the Chinese remainder theorem."""
+
+    def __new__(cls, d, p, q):
+        key = long.__new__(cls, d)
+        key.p = p
+        key.q = q
+        key.dP = d % (p - 1)
+        key.dQ = d % (q - 1)
+        key.qInv = inversemod(q, p)
+        return key
+
+    def __getnewargs__(self):
+        return long(self), self.p, self.q
 
 ##################################################
 ## Arithmetic
 ##################################################
 
+class _PointAtInfinity(object):
+    """The identity of the group of points on an elliptic curve, which has
+    no affine coordinates."""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return "INFINITY"
+
+    def __reduce__(self):
+        return "INFINITY"
+
+INFINITY = _PointAtInfinity()
+
+class CurvePoint(object):
+    """
+    A point on the elliptic curve y**2 = x**3 + a*x + b
+    over Z/pZ in Jacobian coordinates: (X, Y, Z) is the
+    affine point (X/Z**2, Y/Z**3), and any triple with
+    Z = 0 is the point at infinity.  Points add,
+    subtract, negate and multiply by integers without
+    any modular inversion; only affine() needs one.
+    Examples:
+    >>> E = (1, 0, 7)
+    >>> P = CurvePoint.from_affine(E, (1, 3))
+    >>> (P + CurvePoint.from_affine(E, (3, 3))).affine()
+    (3, 4)
+    >>> (9999 * P).affine()
+    (1, 4)
+    >>> (P - P).affine()
+    INFINITY
+    """
+
+    __slots__ = ("curve", "X", "Y", "Z")
+
+    def __init__(self, curve, X, Y, Z=1):
+        self.curve = curve
+        self.X = X
+        self.Y = Y
+        self.Z = Z
+
+    @classmethod
+    def from_affine(cls, curve, P):
+        """The point P = (x, y) or INFINITY on curve = (a, b, p)."""
+        if P is INFINITY:
+            return cls(curve, 1, 1, 0)
+        p = curve[2]
+        return cls(curve, P[0] % p, P[1] % p)
+
+    def affine(self):
+        """This point as a pair (x, y), or INFINITY."""
+        p = self.curve[2]
+        if self.Z % p == 0:
+            return INFINITY
+        if self.Z == 1:
+            return (self.X % p, self.Y % p)
+        z = inversemod(self.Z, p)
+        zz = z * z % p
+        return (self.X * zz % p, self.Y * zz * z % p)
+
+    def double(self):
+        """Twice this point."""
+        a, b, p = self.curve
+        return CurvePoint(self.curve,
+                          *_jacobian_double(self.X, self.Y, self.Z, a, p))
+
+    def is_infinity(self):
+        return self.Z % self.curve[2] == 0
+
+    def __add__(self, other):
+        a, b, p = self.curve
+        if self.Z == 1:
+            self, other = other, self
+        return CurvePoint(self.curve,
+                          *_jacobian_add(self.X, self.Y, self.Z,
+                                         other.X, other.Y, other.Z, a, p))
+
+    def __eq__(self, other):
+        p = self.curve[2]
+        if self.is_infinity() or other.is_infinity():
+            return self.is_infinity() and other.is_infinity()
+        ZZ1 = self.Z * self.Z
+        ZZ2 = other.Z * other.Z
+        return (self.X * ZZ2 - other.X * ZZ1) % p == 0 and \
+               (self.Y * ZZ2 * other.Z - other.Y * ZZ1 * self.Z) % p == 0
+
+    def __mul__(self, m):
+        """The multiple m*P, by the width-w NAF of m: the odd multiples P,
+        3P, ..., (2**(w-1) - 1)P and their negatives are computed first,
+        and normalized to Z = 1 with one inversion, and then every nonzero
+        digit costs one mixed addition besides the doublings, with at least
+        w doublings between nonzero digits."""
+        a, b, p = self.curve
+        digits = _wnaf(m, _wnaf_width(abs(m).bit_length()))
+        largest = max([1] + [abs(digit) for digit in digits])
+        odd = [(self.X, self.Y, self.Z)]
+        if largest > 1:
+            X2, Y2, Z2 = _jacobian_double(self.X, self.Y, self.Z, a, p)
+            while 2 * len(odd) - 1 < largest:
+                X, Y, Z = odd[-1]
+                odd.append(_jacobian_add(X, Y, Z, X2, Y2, Z2, a, p))
+            odd = _affine_triples(odd, p)
+        X, Y, Z = 1, 1, 0
+        for digit in reversed(digits):
+            X, Y, Z = _jacobian_double(X, Y, Z, a, p)
+            if digit > 0:
+                x, y, z = odd[digit >> 1]
+                X, Y, Z = _jacobian_add(X, Y, Z, x, y, z, a, p)
+            elif digit < 0:
+                x, y, z = odd[-digit >> 1]
+                X, Y, Z = _jacobian_add(X, Y, Z, x, -y % p, z, a, p)
+        return CurvePoint(self.curve, X, Y, Z)
+
+    __rmul__ = __mul__
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __neg__(self):
+        return CurvePoint(self.curve, self.X, -self.Y % self.curve[2], self.Z)
+
+    def __repr__(self):
+        return "CurvePoint(%r, %r, %r, %r)" % (self.curve, self.X, self.Y,
+                                               self.Z)
+
+    def __sub__(self, other):
+        return self + -other
+
+class CurveComb(object):
+    """Multiples of one point on an elliptic curve, by the fixed-base comb
+    method.  A scalar of at most max_bits bits is cut into width strips of
+    d = max_bits/width bits; the table holds, in affine form, the sum of
+    2**(j*d) * point over the set bits j of every width-bit index, so a
+    multiple costs d doublings and d mixed additions.  Worth it once the
+    same point is multiplied many times, as with an ElGamal public key."""
+
+    def __init__(self, point, max_bits=None, width=6):
+        a, b, p = point.curve
+        if max_bits is None:
+            max_bits = p.bit_length()
+        self.point = point
+        self.max_bits = max_bits
+        self.width = width
+        self.spacing = (max_bits + width - 1) / width
+        strips = [(point.X, point.Y, point.Z)]
+        for _ in xrange(width - 1):
+            X, Y, Z = strips[-1]
+            for _ in xrange(self.spacing):
+                X, Y, Z = _jacobian_double(X, Y, Z, a, p)
+            strips.append((X, Y, Z))
+        table = [(1, 1, 0)]
+        for index in xrange(1, 1 << width):
+            low = index & -index
+            X, Y, Z = table[index - low]
+            x, y, z = strips[low.bit_length() - 1]
+            table.append(_jacobian_add(X, Y, Z, x, y, z, a, p))
+        self.table = _affine_triples(table, p)
+
+    def __call__(self, m):
+        """The multiple m*point.  Scalars wider than the table fall back to
+        the multiplication of CurvePoint."""
+        return comb_multiply([self], m)[0]
+
+def comb_multiply(combs, m):
+    """
+    Returns the multiples m*P of the points P of several
+    CurveCombs of the same width and max_bits in one pass,
+    reading each column of m's strips once for all of
+    them.
+    Input:
+        combs -- a sequence of CurveCombs
+        m -- a nonnegative integer
+    Output:
+        list -- a list of CurvePoints
+    """
+    assert m >= 0, "m must be nonnegative."
+    if not combs:
+        return []
+    width = combs[0].width
+    spacing = combs[0].spacing
+    assert all(comb.width == width and comb.spacing == spacing
+               for comb in combs), "combs must have the same shape."
+    if m.bit_length() > combs[0].max_bits:
+        return [m * comb.point for comb in combs]
+    mask = (1 << spacing) - 1
+    strips = [bin(((m >> (j * spacing)) & mask) | (mask + 1))[3:]
+              for j in xrange(width - 1, -1, -1)]
+    curve = combs[0].point.curve
+    a, b, p = curve
+    results = []
+    for comb in combs:
+        table = comb.table
+        X, Y, Z = 1, 1, 0
+        for column in zip(*strips):
+            X, Y, Z = _jacobian_double(X, Y, Z, a, p)
+            index = int("".join(column), 2)
+            if index:
+                x, y, z = table[index]
+                X, Y, Z = _jacobian_add(X, Y, Z, x, y, z, a, p)
+        results.append(CurvePoint(curve, X, Y, Z))
+    return results
+
+def ellcurve_add_many(E, pairs):
+    """
+    Returns the sums P1 + P2 of all the pairs of points
+    on the elliptic curve E, in affine coordinates, with
+    one modular inversion for all of them.
+    Input:
+        E -- an elliptic curve over Z/pZ, given by a
+             triple of integers (a, b, p), with p odd.
+        pairs -- a sequence of pairs of points, each a
+             pair of integers (x, y) or INFINITY
+    Output:
+        list -- a list of pairs of integers or INFINITY
+    Examples:
+    >>> E = (1, 0, 7)
+    >>> ellcurve_add_many(E, [((1, 3), (3, 3)), ((1, 3), (1, 4))])
+    [(3, 4), INFINITY]
+    """
+    a, b, p = E
+    sums = [INFINITY] * len(pairs)
+    slopes = []
+    for i, (P1, P2) in enumerate(pairs):
+        if P1 is INFINITY or P2 is INFINITY:
+            sums[i] = P2 if P1 is INFINITY else P1
+            continue
+        x1, y1 = P1
+        x2, y2 = P2
+        if (x1 - x2) % p:
+            slopes.append((i, y1 - y2, x1 - x2))
+        elif (y1 + y2) % p:
+            slopes.append((i, 3*x1*x1 + a, 2*y1))
+    inverses = batch_inverse([denominator for i, _, denominator in slopes], p)
+    for (i, numerator, _), inverse in zip(slopes, inverses):
+        (x1, y1), (x2, y2) = pairs[i]
+        lam = numerator * inverse % p
+        x3 = (lam*lam - x1 - x2) % p
+        sums[i] = (x3, (lam*(x1 - x3) - y1) % p)
+    return sums
+
 def ellcurve_add(E, P1, P2):
     """
     Returns the sum of P1 and P2 on the elliptic
@@ -225,8 +830,7 @@ def ellcurve_add(E, P1, P2):
     Input:
          E -- an elliptic curve over Z/pZ, given by a
               triple of integers (a, b, p), with p odd.
-         P1 --a pair of integers (x, y) or the
-              string "Identity".
+         P1 --a pair of integers (x, y) or INFINITY.
          P2 -- same type as P1
     Output:
          R -- same type as P1
@@ -236,46 +840,27 @@ def ellcurve_add(E, P1, P2):
     >>> ellcurve_add(E, P1, P2)
     (3, 4)
     >>> ellcurve_add(E, P1, (1, 4))
-    'Identity'
-    >>> ellcurve_add(E, "Identity", P2)
+    INFINITY
+    >>> ellcurve_add(E, INFINITY, P2)
     (3, 3)
     """
-    a, b, p = E
-    assert p > 2, "p must be odd."
-    if P1 == "Identity":
-        return P2
-    if P2 == "Identity":
-        return P1
-    x1, y1 = P1
-    x2, y2 = P2
-    x1 %= p
-    y1 %= p
-    x2 %= p
-    y2 %= p
-    if x1 == x2 and y1 == p-y2:
-        return "Identity"
-    if P1 == P2:
-        if y1 == 0:
-            return "Identity"
-        lam = (3*x1**2+a) * inversemod(2*y1, p)
-    else:
-        lam = (y1 - y2) * inversemod(x1 - x2, p)
-    x3 = lam**2 - x1 - x2
-    y3 = -lam*x3 - y1 + lam*x1
-    return (x3 % p, y3 % p)
+    assert E[2] > 2, "p must be odd."
+    return (CurvePoint.from_affine(E, P1) +
+            CurvePoint.from_affine(E, P2)).affine()
 
 def ellcurve_mul(E, m, P):
     """
     Returns the multiple m*P of the point P on
-    the elliptic curve E.
+    the elliptic curve E.  The multiplication runs in
+    Jacobian coordinates, with a single modular
+    inversion at the end.
     Input:
         E -- an elliptic curve over Z/pZ, given by a
              triple (a, b, p).
         m -- an integer
-        P -- a pair of integers (x, y) or the
-             string "Identity"
+        P -- a pair of integers (x, y) or INFINITY
     Output:
-        A pair of integers or the string "Identity".
+        A pair of integers or INFINITY.
     Examples:
     >>> E = (1, 0, 7)
     >>> P = (1, 3)
@@ -285,14 +870,139 @@ def ellcurve_mul(E, m, P):
     (1, 4)
     """
     assert m >= 0, "m must be nonnegative."
-    power = P
-    mP = "Identity"
-    while m != 0:
-        if m % 2 != 0:
-            mP = ellcurve_add(E, mP, power)
-        power = ellcurve_add(E, power, power)
-        m /= 2
-    return mP
+    return (m * CurvePoint.from_affine(E, P)).affine()
+
+def normalize_points(points):
+    """
+    Returns the CurvePoints, all on curves over the same
+    field, in affine coordinates, with one modular
+    inversion for all of them.
+    Input:
+        points -- a sequence of CurvePoints
+    Output:
+        list -- a list of pairs of integers or INFINITY
+    Examples:
+    >>> P = CurvePoint.from_affine((1, 0, 7), (1, 3))
+    >>> normalize_points([P.double(), P - P, 5 * P])
+    [(0, 0), INFINITY, (1, 3)]
+    """
+    if not points:
+        return []
+    p = points[0].curve[2]
+    triples = _affine_triples([(P.X, P.Y, P.Z) for P in points], p)
+    return [INFINITY if Z == 0 else (X, Y) for X, Y, Z in triples]
+
+def _affine_add(E, P1, P2):
+    """ellcurve_add in affine coordinates, with a modular inversion for
+    every addition; kept to check and benchmark CurvePoint against."""
+    a, b, p = E
+    if P1 is INFINITY:
+        return P2
+    if P2 is INFINITY:
+        return P1
+    x1, y1 = P1
+    x2, y2 = P2
+    if x1 == x2 and (y1 + y2) % p == 0:
+        return INFINITY
+    if x1 == x2:
+        lam = (3*x1*x1 + a) * inversemod(2*y1, p)
+    else:
+        lam = (y1 - y2) * inversemod(x1 - x2, p)
+    x3 = (lam*lam - x1 - x2) % p
+    return (x3, (lam*(x1 - x3) - y1) % p)
+
+def _affine_mul(E, m, P):
+    """m*P by affine double-and-add."""
+    R = INFINITY
+    for bit in bin(m)[2:]:
+        R = _affine_add(E, R, R)
+        if bit == "1":
+            R = _affine_add(E, R, P)
+    return R
+
+def _affine_triples(triples, p):
+    """The Jacobian triples with Z = 1, or (1, 1, 0) for the point at
+    infinity, for the same points as the given triples, with a single
+    inversion."""
+    finite = [i for i, (X, Y, Z) in enumerate(triples) if Z % p]
+    inverses = batch_inverse([triples[i][2] for i in finite], p)
+    normal = [(1, 1, 0)] * len(triples)
+    for i, z in zip(finite, inverses):
+        X, Y, Z = triples[i]
+        zz = z * z % p
+        normal[i] = (X * zz % p, Y * zz * z % p, 1)
+    return normal
+
+def _jacobian_add(X1, Y1, Z1, X2, Y2, Z2, a, p):
+    """The sum of two points in Jacobian coordinates; the cheaper mixed
+    addition when Z2 = 1."""
+    if Z1 % p == 0:
+        return X2, Y2, Z2
+    if Z2 % p == 0:
+        return X1, Y1, Z1
+    ZZ1 = Z1 * Z1 % p
+    if Z2 == 1:
+        U1 = X1
+        S1 = Y1
+        U2 = X2 * ZZ1 % p
+        S2 = Y2 * Z1 * ZZ1 % p
+    else:
+        ZZ2 = Z2 * Z2 % p
+        U1 = X1 * ZZ2 % p
+        S1 = Y1 * Z2 * ZZ2 % p
+        U2 = X2 * ZZ1 % p
+        S2 = Y2 * Z1 * ZZ1 % p
+    H = (U2 - U1) % p
+    r = (S2 - S1) % p
+    if H == 0:
+        if r == 0:
+            return _jacobian_double(X1, Y1, Z1, a, p)
+        return 1, 1, 0
+    HH = H * H % p
+    HHH = H * HH % p
+    V = U1 * HH % p
+    X3 = (r * r - HHH - 2 * V) % p
+    Y3 = (r * (V - X3) - S1 * HHH) % p
+    Z3 = Z1 * H % p if Z2 == 1 else Z1 * Z2 * H % p
+    return X3, Y3, Z3
+
+def _jacobian_double(X, Y, Z, a, p):
+    """Twice a point in Jacobian coordinates on y**2 = x**3 + a*x + b."""
+    if Y % p == 0 or Z % p == 0:
+        return 1, 1, 0
+    YY = Y * Y % p
+    S = 4 * X * YY % p
+    ZZ = Z * Z % p
+    M = (3 * X * X + a * ZZ * ZZ) % p
+    X3 = (M * M - 2 * S) % p
+    Y3 = (M * (S - X3) - 8 * YY * YY) % p
+    return X3, Y3, 2 * Y * Z % p
+
+def _wnaf(m, width):
+    """The width-w non-adjacent form of m, least significant digit first:
+    every digit is zero or odd with absolute value below 2**(width-1), and
+    any width consecutive digits hold at most one nonzero."""
+    digits = []
+    sign = 1 if m >= 0 else -1
+    m = abs(m)
+    while m:
+        digit = 0
+        if m & 1:
+            digit = m & ((1 << width) - 1)
+            if digit >> (width - 1):
+                digit -= 1 << width
+            m -= digit
+        digits.append(sign * digit)
+        m >>= 1
+    return digits
+
+def _wnaf_width(bits):
+    """NAF width minimizing the additions of CurvePoint multiplication by
+    a multiplier of the given length, table included."""
+    for width, limit in [(2, 8), (3, 40), (4, 160)]:
+        if bits <= limit:
+            return width
+    return 5
 
 ##################################################
 ## Integer Factorization
@@ -325,7 +1035,11 @@ def randcurve(p):
 def elliptic_curve_method(N, m, tries=5):
     """
     Use the elliptic curve method to try to find a
-    nontrivial divisor of N.
+    nontrivial divisor of N.  Each try multiplies a point
+    on a random Suyama curve by m, in projective
+    Montgomery coordinates, and checks whether the
+    result is the identity modulo some factor of N.
+    (See numbertheory.ecm for the full two-stage method.)
     Input:
         N -- a positive integer
         m -- a positive integer, the least common
@@ -349,13 +1063,16 @@ def elliptic_curve_method(N, m, tries=5):
     117775675640754751L   #rand
     """
     for _ in range(tries):                     # (1)
-        E, P = randcurve(N)                    # (2)
-        try:                                   # (3)
-            Q = ellcurve_mul(E, m, P)          # (4)
-        except ZeroDivisionError, x:           # (5)
-            g = gcd(x[0], N)                    # (6)
-            if g != 1 or g != N:
-                return g      # (7)
+        sigma = randrange(6, N - 1)            # (2)
+        try:
+            X, Z, a24 = suyama_curve(sigma, N)
+        except ZeroDivisionError, x:           # (3)
+            g = gcd(x[0], N)
+        else:
+            X, Z = montgomery_multiply(m, X, Z, a24, N)   # (4)
+            g = gcd(Z, N)                      # (5)
+        if g != 1 and g != N:
+            return g                           # (6)
     return N
 
 ##################################################
@@ -394,7 +1111,28 @@ def elgamal_init(p):
     E, B = randcurve(p)
     n = randrange(2, p)
     nB = ellcurve_mul(E, n, B)
-    return (E, B, nB), (E, n)
+    return ElGamalPublicKey(E, B, nB), (E, n)
+
+class ElGamalPublicKey(tuple):
+    """An ElGamal public key (E, B, n*B), usable anywhere the plain triple
+    is, that also keeps the CurveCombs for B and n*B once combs() has built
+    them, so that the tables are paid for once per key rather than once per
+    block.  The tables travel with the key when it is pickled to worker
+    processes."""
+
+    def __new__(cls, E, B, nB):
+        return tuple.__new__(cls, (E, B, nB))
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    def combs(self):
+        """The CurveCombs for B and n*B."""
+        if "_combs" not in self.__dict__:
+            E, B, nB = self
+            self._combs = [CurveComb(CurvePoint.from_affine(E, B)),
+                           CurveComb(CurvePoint.from_affine(E, nB))]
+        return self._combs
 
 def elgamal_encrypt(plain_text, public_key):
     """
@@ -413,22 +1151,45 @@ def elgamal_encrypt(plain_text, public_key):
     [((6004308617723068486L, 15578511190582849677L), \ #rand
      (7064405129585539806L, 8318592816457841619L))]    #rand
     """
+    p = public_key[0][2]
+    assert p > 10000, "p must be at least 10000."
+    return _elgamal_encrypt_numbers(str_to_numlist(plain_text, p/1000),
+                                    public_key)
+
+def _elgamal_encrypt_numbers(numbers, public_key):
+    """Encrypt a list of integers below p/1000, as produced by
+    str_to_numlist, with the ElGamal public key."""
+    if not isinstance(public_key, ElGamalPublicKey):
+        public_key = ElGamalPublicKey(*public_key)
     E, B, nB = public_key
     a, b, p = E
-    assert p > 10000, "p must be at least 10000."
-    v = [1000*x for x in \
-           str_to_numlist(plain_text, p/1000)]       # (1)
-    cipher = []
-    for x in v:
-        while not legendre(x**3+a*x+b, p) == 1:        # (2)
-            x = (x+1) % p
-        y = sqrtmod(x**3+a*x+b, p)                   # (3)
-        P = (x, y)
+    combs = public_key.combs()
+    points = []
+    for P in _elgamal_encode(numbers, E):
         r = randrange(1, p)
-        encrypted = (ellcurve_mul(E, r, B), \
-                ellcurve_add(E, P, ellcurve_mul(E, r, nB)))
-        cipher.append(encrypted)
-    return cipher
+        rB, rnB = comb_multiply(combs, r)
+        points.extend([rB, rnB + P])
+    points = normalize_points(points)
+    return zip(points[::2], points[1::2])
+
+def _elgamal_encode(numbers, E):
+    """The points of E that encode the integers below p/1000: the first x
+    from 1000 times the integer up with x**3 + a*x + b a square mod p,
+    found with the Jacobi symbol, and its square root, found for all the
+    integers at once."""
+    a, b, p = E
+    xs = []
+    squares = []
+    for x in numbers:
+        x *= 1000                                       # (1)
+        square = (x*x*x + a*x + b) % p
+        while jacobi(square, p) != 1:                   # (2)
+            x = (x+1) % p
+            square = (x*x*x + a*x + b) % p
+        xs.append(x)
+        squares.append(square)
+    return [CurvePoint(E, x, y)                         # (3)
+            for x, y in zip(xs, sqrtmod_many(squares, p))]
 
 def elgamal_decrypt(cipher_text, private_key):
     """
@@ -445,17 +1206,187 @@ def elgamal_decrypt(cipher_text, private_key):
     >>> print elgamal_decrypt(v, private)
     TOP SECRET MESSAGE!
     """
+    p = private_key[0][2]
+    return numlist_to_str(_elgamal_decrypt_points(cipher_text, private_key),
+                          p/1000)
+
+def _elgamal_decrypt_points(cipher_text, private_key):
+    """Decrypt a list of pairs of points to the integers that
+    _elgamal_encrypt_numbers encrypted."""
     E, n = private_key
-    p = E[2]
-    plain = []
-    for rB, P_plus_rnB in cipher_text:
-        nrB = ellcurve_mul(E, n, rB)
-        minus_nrB = (nrB[0], -nrB[1])
-        P = ellcurve_add(E, minus_nrB, P_plus_rnB)
-        plain.append(P[0]/1000)
-    return numlist_to_str(plain, p/1000)
+    points = [CurvePoint.from_affine(E, P_plus_rnB) -
+              n * CurvePoint.from_affine(E, rB)
+              for rB, P_plus_rnB in cipher_text]
+    return [P[0]/1000 for P in normalize_points(points)]
+
+##################################################
+## Streaming Encryption
+##################################################
+
+# Identifies the framed ciphertext format of write_frames.
+FRAME_MAGIC = "PKCF"
+
+# Blocks that the streaming functions hand to a worker at a time.
+STREAM_BLOCKS_PER_TASK = 64
+
+def elgamal_decrypt_stream(cipher, private_key, stream, workers=None):
+    """
+    Decrypt the pairs of points made by
+    elgamal_encrypt_stream, writing the plain text to
+    stream as it is recovered.
+    Input:
+        cipher -- an iterable of pairs of points on E
+        private_key -- a pair (E, n), as output by
+                       elgamal_init
+        stream -- a file-like object to write to
+        workers -- (optional) a number of processes
+    """
+    p = private_key[0][2]
+    plain = map_batched(_elgamal_decrypt_points,
+                        chunked(cipher, STREAM_BLOCKS_PER_TASK), 1, workers,
+                        (private_key,))
+    decode_stream(chain.from_iterable(plain), p/1000, stream)
+
+def elgamal_encrypt_stream(stream, public_key, workers=None):
+    """
+    Generate the ElGamal encryption of everything read
+    from stream, block by block, as elgamal_encrypt would
+    encrypt it.  Only a few groups of blocks per worker
+    are held in memory at a time.
+    Input:
+        stream -- a file-like object to read from
+        public_key -- a triple (E, B, n*B), as output by
+                      elgamal_init
+        workers -- (optional) a number of processes
+    Output:
+        generator -- pairs of points on E
+    """
+    p = public_key[0][2]
+    assert p > 10000, "p must be at least 10000."
+    public_key = ElGamalPublicKey(*public_key)
+    public_key.combs()
+    blocks = chunked(encode_stream(stream, p/1000), STREAM_BLOCKS_PER_TASK)
+    cipher = map_batched(_elgamal_encrypt_numbers, blocks, 1, workers,
+                         (public_key,))
+    return chain.from_iterable(cipher)
+
+def read_frames(stream):
+    """
+    Generate the integers of a framed ciphertext written
+    by write_frames.
+    Input:
+        stream -- a file-like object to read from
+    Output:
+        generator -- the integers, in order
+    """
+    header = _read_fully(stream, len(FRAME_MAGIC) + 4)
+    if len(header) != len(FRAME_MAGIC) + 4 or \
+       not header.startswith(FRAME_MAGIC):
+        raise ValueError("Not a framed ciphertext.")
+    width, = struct.unpack(">I", header[len(FRAME_MAGIC):])
+    while True:
+        data = _read_fully(stream, width * STREAM_BLOCKS_PER_TASK)
+        if not data:
+            return
+        if len(data) % width != 0:
+            raise ValueError("Truncated ciphertext.")
+        text = hexlify(data)
+        for i in xrange(0, len(text), 2 * width):
+            yield int(text[i:i + 2 * width], 16)
+
+def rsa_decrypt_stream(cipher, d, n, stream, workers=None):
+    """
+    Decrypt the integers made by rsa_encrypt_stream,
+    writing the plain text to stream as it is recovered.
+    Input:
+        cipher -- an iterable of integers
+        d -- an integer or RSAPrivateKey
+        n -- an integer, the modulus
+        stream -- a file-like object to write to
+        workers -- (optional) a number of processes
+    """
+    plain = map_batched(rsa_power, chunked(cipher, STREAM_BLOCKS_PER_TASK),
+                        1, workers, (d, n))
+    decode_stream(chain.from_iterable(plain), n, stream)
+
+def rsa_encrypt_stream(stream, e, n, workers=None):
+    """
+    Generate the RSA encryption of everything read from
+    stream, block by block, as rsa_encrypt would encrypt
+    it.  Only a few groups of blocks per worker are held
+    in memory at a time.
+    Input:
+        stream -- a file-like object to read from
+        e -- an integer, the encryption exponent
+        n -- an integer, the modulus
+        workers -- (optional) a number of processes
+    Output:
+        generator -- integers between 0 and n-1
+    """
+    blocks = chunked(encode_stream(stream, n), STREAM_BLOCKS_PER_TASK)
+    return chain.from_iterable(map_batched(rsa_power, blocks, 1, workers,
+                                           (e, n)))
+
+def write_frames(stream, numbers, width):
+    """
+    Write integers below 256**width to stream as
+    fixed-width big-endian fields after a short header
+    (FRAME_MAGIC and the width).
+    Input:
+        stream -- a file-like object to write to
+        numbers -- an iterable of integers
+        width -- the width of each field in bytes
+    """
+    stream.write(FRAME_MAGIC + struct.pack(">I", width))
+    for group in chunked(numbers, STREAM_BLOCKS_PER_TASK):
+        stream.write(unhexlify("".join(["%0*x" % (2 * width, x)
+                                        for x in group])))
 
 
+##################################################
+## Auditing RSA Moduli
+##################################################
+
+def audit_moduli(moduli, directory=None):
+    """
+    Find the RSA moduli that share a prime with some
+    other modulus, with numbertheory.batch_gcd, or with
+    batch_gcd_on_disk when there are too many moduli for
+    the product tree to fit in memory.  A modulus all of
+    whose primes are shared is split by comparing it with
+    the other weak moduli one by one.
+    Input:
+        moduli -- a sequence of RSA moduli, or anything
+                  that can be iterated over twice, such
+                  as a class reading them from a file
+        directory -- (optional) a directory to keep the
+                  trees in, on disk
+    Output:
+        list -- a triple (i, n, p) for every weak modulus,
+                where n is the i-th modulus and p is a
+                prime it shares, or n itself if n occurs
+                more than once
+    Examples:
+    >>> audit_moduli([15, 21, 35, 143])
+    [(0, 15, 3), (1, 21, 3), (2, 35, 5)]
+    """
+    if directory is None:
+        divisors = batch_gcd(moduli)
+    else:
+        divisors = batch_gcd_on_disk(moduli, directory)
+    weak = [(i, n, g) for i, (n, g) in enumerate(izip(moduli, divisors))
+            if g != 1]
+    audit = []
+    for i, n, g in weak:
+        if g == n:
+            for j, m, _ in weak:
+                if j != i and gcd(n, m) != 1:
+                    g = gcd(n, m)
+                    if g != n:
+                        break
+        audit.append((i, n, g))
+    return audit
+
 ##################################################
 ## Associativity of the Group Law
 ##################################################
@@ -600,3 +1531,205 @@ def prove_associative():                        # (15)
                    - (x1 + x5)*(x1 - x5)*(x1 - x5))
     print "Associative?"
     print s1 == s2                              # (17)
+
+##################################################
+## Benchmarks
+##################################################
+
+def benchmark_ellcurve_mul(digit_sizes=(20, 50, 100, 150), trials=10):
+    """Print the time per scalar multiplication, in milliseconds, of
+    affine double-and-add, of CurvePoint and of a CurveComb, and the time
+    per ElGamal block of the two multiplications r*B and r*n*B, separately
+    and by one comb_multiply, for a random curve over a random prime and
+    full-size multipliers of each size."""
+    print "%6s %10s %10s %10s %10s %10s" % ("digits", "affine", "wnaf",
+                                           "comb", "2 x wnaf", "pair")
+    for digits in digit_sizes:
+        public, private = elgamal_init(random_prime(digits))
+        E, B, nB = public
+        P = CurvePoint.from_affine(E, B)
+        Q = CurvePoint.from_affine(E, nB)
+        combs = public.combs()
+        multipliers = [randrange(E[2]) for _ in xrange(trials)]
+        timings = [
+            _time_each(lambda m: _affine_mul(E, m, B), multipliers),
+            _time_each(lambda m: (m * P).affine(), multipliers),
+            _time_each(lambda m: combs[0](m).affine(), multipliers),
+            _time_each(lambda m: ((m * P).affine(), (m * Q).affine()),
+                       multipliers),
+            _time_each(lambda m: [R.affine()
+                                  for R in comb_multiply(combs, m)],
+                       multipliers)]
+        print "%6d" % digits + "".join(" %10.2f" % (t / 1e3)
+                                       for t in timings)
+
+###############################################################################
+################################## UNIT TESTS #################################
+###############################################################################
+
+from StringIO import StringIO
+from numbertheory import discrete_log
+from py.test import raises
+import pickle
+
+def test_curve_point():
+    E = (1, 0, 7)
+    P = CurvePoint.from_affine(E, (1, 3))
+    assert INFINITY == (P + -P).affine()
+    assert INFINITY == ellcurve_add(E, (1, 3), (1, 4))
+    assert (3, 3) == ellcurve_add(E, INFINITY, (3, 3))
+    assert P.double() == P + P
+    E, B = randcurve(2**89 - 1)
+    P = CurvePoint.from_affine(E, B)
+    for m in [0, 1, 2, 3, 255, 256, 2**89, 12345678901234567890]:
+        assert _affine_mul(E, m, B) == ellcurve_mul(E, m, B)
+        assert (m * P).affine() == ellcurve_mul(E, m, B)
+    Q = 1000 * P
+    assert Q.Z != 1
+    assert (Q + 77 * P).affine() == (1077 * P).affine()
+    assert (Q - 1000 * P).is_infinity()
+    assert (-3 * P).affine() == (-(3 * P)).affine()
+    points = [m * P for m in range(-3, 4)] + [Q]
+    assert [R.affine() for R in points] == normalize_points(points)
+    pairs = [(R, S) for R in normalize_points(points[:4])
+             for S in normalize_points(points[3:])]
+    assert [_affine_add(E, R, S) for R, S in pairs] == \
+           ellcurve_add_many(E, pairs)
+    for m in [0, 1, 7, -7, 12345, 2**64 - 1]:
+        for width in [2, 3, 5]:
+            digits = _wnaf(m, width)
+            assert m == sum(d << i for i, d in enumerate(digits))
+            assert all(d == 0 or (d % 2 and abs(d) < 2**(width - 1))
+                       for d in digits)
+    combs = [CurveComb(P), CurveComb(Q, width=4)]
+    raises(AssertionError, comb_multiply, combs, 5)
+    combs[1] = CurveComb(Q)
+    for m in [0, 1, 2**89 - 2, 98765432109876543210, 2**100]:
+        assert [(m * P).affine(), (m * Q).affine()] == \
+               [R.affine() for R in comb_multiply(combs, m)]
+    public, private = elgamal_init(2**61 - 1)
+    message = "Elliptic curves."
+    assert message == elgamal_decrypt(elgamal_encrypt(message, public),
+                                      private)
+    assert message == elgamal_decrypt(elgamal_encrypt(message,
+                                                      tuple(public)), private)
+    public.combs()
+    copy = pickle.loads(pickle.dumps(public, 2))
+    assert isinstance(copy, ElGamalPublicKey) and tuple(public) == copy
+    assert copy.combs()[1].table == public.combs()[1].table
+
+def test_audit_moduli(tmpdir):
+    primes = [random_prime(12) for _ in range(8)]
+    moduli = [primes[0] * primes[1], primes[2] * primes[3],
+              primes[1] * primes[4], primes[5] * primes[6],
+              primes[2] * primes[3], primes[4] * primes[7]]
+    expected = [(0, moduli[0], primes[1]), (1, moduli[1], moduli[1]),
+                (2, moduli[2], None), (4, moduli[4], moduli[4]),
+                (5, moduli[5], primes[4])]
+    for audit in [audit_moduli(moduli), audit_moduli(moduli, str(tmpdir))]:
+        assert [(i, n) for i, n, _ in expected] == [(i, n) for i, n, _ in audit]
+        for (i, n, p), (_, _, shared) in zip(expected, audit):
+            assert shared == p or (p is None and shared in primes[1::3])
+    assert [] == audit_moduli([35, 143])
+
+def test_dh():
+    p = dh_group(40)
+    n, npow = dh_init(p)
+    m, mpow = dh_init(p)
+    assert dh_secret(p, n, mpow) == dh_secret(p, m, npow)
+    # 2 has order (p - 1)/2 or p - 1 modulo a safe prime.
+    assert n % ((p - 1) / 2) == discrete_log(2, npow, p) % ((p - 1) / 2)
+
+def test_encoding():
+    for bound in [256, 1000, 2**16, 10**20, 2**1024]:
+        for message in ["", "Run!", "\x00", "a\x00b\x00\x00", "\x01" * 300,
+                        "".join(chr(i) for i in range(256)) * 3]:
+            encoded = str_to_numlist(message, bound)
+            assert all(0 <= x < bound for x in encoded)
+            assert message == numlist_to_str(encoded, bound)
+    assert "Run!" == numlist_to_str([82, 117, 110, 33, 1], 1000)
+    raises(ValueError, numlist_to_str, [82, 117, 110, 33], 1000)
+    raises(ValueError, numlist_to_str, [82, 256, 1], 1000)
+    raises(ValueError, numlist_to_str, [82, -1, 1], 1000)
+
+def test_encode_stream():
+    for size in [0, 1, 7, 8, 9, 100, 1000]:
+        message = urandom(size)
+        encoded = list(encode_stream(StringIO(message), 10**20, 16))
+        assert message == numlist_to_str(encoded, 10**20)
+        decoded = StringIO()
+        decode_stream(iter(encoded), 10**20, decoded, 16)
+        assert message == decoded.getvalue()
+        trickle = _ShortReads(StringIO(message), 5)
+        encoded = list(encode_stream(trickle, 10**20, 16))
+        assert message == numlist_to_str(encoded, 10**20)
+
+class _ShortReads(object):
+    """A stream that returns at most size bytes from each read, as a pipe
+    may."""
+
+    def __init__(self, stream, size):
+        self.stream = stream
+        self.size = size
+
+    def read(self, size=-1):
+        return self.stream.read(min(size, self.size))
+
+def test_streaming():
+    message = urandom(5000)
+    e, d, n = rsa_init(2**61 - 1, 2**89 - 1)
+    framed = StringIO()
+    write_frames(framed, rsa_encrypt_stream(StringIO(message), e, n,
+                                            workers=2), 19)
+    framed.seek(0)
+    plain = StringIO()
+    rsa_decrypt_stream(read_frames(framed), d, n, plain)
+    assert message == plain.getvalue()
+    framed.seek(0)
+    plain = StringIO()
+    rsa_decrypt_stream(read_frames(_ShortReads(framed, 7)), d, n, plain)
+    assert message == plain.getvalue()
+    raises(ValueError, list, read_frames(StringIO("PKCF")))
+
+def test_random_prime():
+    assert [101, 103, 107, 109, 113] == sieve_candidates(101, 10)
+    assert [3, 5, 7, 11, 17, 23] == sieve_candidates(3, 20, safe=True)
+    assert all(is_prime(p) for p in sieve_candidates(1, 1 << 12)[1:])
+    assert 10 <= random_prime(2) < 100
+    for bits in [2, 3, 16, 128]:
+        p = random_prime_bits(bits)
+        assert is_prime(p) and p.bit_length() == bits
+    for bits in [3, 32, 96]:
+        p = random_prime_bits(bits, safe=True)
+        assert is_prime(p) and is_prime((p - 1) / 2)
+        assert p.bit_length() == bits
+    for bits in [64, 65, 66, 67, 128]:
+        p = random_prime_bits(bits, strong=True)
+        assert is_prime(p) and p.bit_length() == bits
+    raises(AssertionError, random_prime_bits, 1)
+    raises(AssertionError, random_prime_bits, 2, safe=True)
+    raises(AssertionError, random_prime_bits, 63, strong=True)
+    assert random_prime_bits(64, workers=2).bit_length() == 64
+    p = dh_group()
+    assert p == RFC3526_PRIME and is_prime((p - 1) / 2)
+    assert dh_group(48) is dh_group(48)
+    n, power = dh_init()
+    assert powermod(2, n, p) == power
+    for q in primes(1000)[-2 * DH_POWER_CACHE_SIZE:] + [p]:
+        n, power = dh_init(q)
+        assert powermod(2, n, q) == power
+    assert DH_POWER_CACHE_SIZE == len(_dh_powers)
+    assert p == next(reversed(_dh_powers))
+
+def test_rsa():
+    p = 2**61 - 1
+    q = 2**89 - 1
+    e, d, n = rsa_init(p, q)
+    assert isinstance(d, RSAPrivateKey)
+    assert 1 == e * d % ((p - 1) * (q - 1))
+    blocks = [0, 1, 2, n - 1, 123456789 * 987654321]
+    assert [powermod(x, d, n) for x in blocks] == rsa_power(blocks, d, n)
+    assert "Run Nikita!" == rsa_decrypt(rsa_encrypt("Run Nikita!", e, n), d, n)
+    assert "Run Nikita!" == rsa_decrypt(rsa_encrypt("Run Nikita!", e, n),
+                                        long(d), n)
+    assert "Signed." == rsa_verify(rsa_sign("Signed.", d, n), e, n)
@@ -21,29 +21,117 @@
 #testing, Legendere
 """Common problems in arithmetic and number theory."""
 
-from extensions.itertools import all_up_to
-from itertools import imap
-from operator import mul
-from math import floor, sqrt
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from heapq import heappop, heappush
+from itertools import compress, groupby, imap, islice, izip, repeat
+from operator import add, mod, mul, neg, sub
+from math import floor, log, sqrt
+from multiprocessing import Pool, TimeoutError, cpu_count
+from random import randrange
+import marshal
+import os
+import random
+import time
+
+def divisor_count(number):
+    """
+    Returns the number of positive divisors of number,
+    from its factorization, without listing them.
+    Input:
+        number -- a positive integer or a Factorization
+    Output:
+        int -- the number of divisors
+    Examples:
+    >>> divisor_count(28)
+    6
+    >>> divisor_count(2**10 * 3**5 * 5**3)
+    264
+    """
+    count = 1
+    for p, e in factorization(number):
+        count *= e + 1
+    return count
+
+def divisor_sigma(number, k=1):
+    """
+    Returns the sum of the kth powers of the positive
+    divisors of number, from its factorization, without
+    listing them.
+    Input:
+        number -- a positive integer or a Factorization
+        k -- (optional) a nonnegative integer
+    Output:
+        int -- the sum of d**k over the divisors d
+    Examples:
+    >>> divisor_sigma(28)
+    56
+    >>> divisor_sigma(6, 2)
+    50
+    >>> divisor_sigma(6, 0)
+    4
+    """
+    if k == 0:
+        return divisor_count(number)
+    sigma = 1
+    for p, e in factorization(number):
+        q = p**k
+        sigma *= (q**(e + 1) - 1) / (q - 1)
+    return sigma
 
 def divisors(number):
-    """divisors(number) -> All the divisors of the given number."""
-    if number < 0:
+    """divisors(number) -> All the divisors of the given number, which may
+    be given as a Factorization.  Each prime power multiplies the divisors
+    found so far, so every divisor costs one multiplication."""
+    if isinstance(number, Factorization):
+        pairs = number
+    elif number < 0:
         positive = divisors(-number)
         negative = [-divisor for divisor in reversed(positive)]
         return negative + positive
     elif number == 0:
         raise Exception
-    elif number == 1:
-        return [1]
-    factorization = prime_factorization(number)
-    factors = [item[0] for item in factorization]
-    exponents = [item[1] for item in factorization]
-    found = []
-    for exponent_combo in all_up_to(exponents):
-        found.append(reduce(mul, (factor ** exponent for factor, exponent
-                             in zip(factors, exponent_combo))))
-    return sorted(found)
+    else:
+        pairs = factorization(number)
+    found = [1]
+    for p, e in pairs:
+        previous = found
+        for _ in xrange(e):
+            previous = [divisor * p for divisor in previous]
+            found.extend(previous)
+    found.sort()
+    return found
+
+def iter_divisors(number):
+    """
+    Generates the positive divisors of number in
+    ascending order, lazily, from a heap of the smallest
+    ones not yet generated.  Each divisor is pushed once,
+    by the divisor with one fewer factor of its largest
+    prime, so the heap holds only a fraction of the
+    numbers divisors(number) would list.
+    Input:
+        number -- a positive integer or a Factorization
+    Output:
+        generator -- the divisors in ascending order
+    Examples:
+    >>> list(iter_divisors(28))
+    [1, 2, 4, 7, 14, 28]
+    >>> list(islice(iter_divisors(2**100 * 3**100), 6))
+    [1, 2, 3, 4, 6, 8]
+    """
+    pairs = list(factorization(number))
+    # Entries (d, i, e): d has e factors of the ith prime and none of
+    # the later ones.
+    heap = [(1, -1, 0)]
+    while heap:
+        d, i, e = heappop(heap)
+        yield d
+        if i >= 0 and e < pairs[i][1]:
+            heappush(heap, (d * pairs[i][0], i, e + 1))
+        for j in xrange(i + 1, len(pairs)):
+            heappush(heap, (d * pairs[j][0], j, 1))
 
 def dotproduct(vec1, vec2):
     """The dot-product of the given vectors."""
@@ -66,30 +154,245 @@ def crt(a, b, m, n):
     >>> crt(-1, -1, 100, 101)
     10099
     """
-    g, c, _ = xgcd(m, n)
-    assert g == 1, "m and n must be coprime."
-    return (a + (b-a)*c*m) % (m*n)
+    assert gcd(m, n) == 1, "m and n must be coprime."
+    return chinese_remainder([a, b], [m, n])
+
+def chinese_remainder(residues, moduli):
+    """
+    Return the unique integer between 0 and M - 1, where
+    M is the product of the moduli, that reduces to
+    residues[i] modulo moduli[i] for every i.  The
+    solution is built one modulus at a time by Garner's
+    algorithm: x is corrected by a multiple of the
+    product of the moduli already used.
+    Input:
+        residues -- a sequence of integers
+        moduli -- a sequence of pairwise coprime positive
+                  integers
+    Output:
+        int -- an integer between 0 and M - 1.
+    Examples:
+    >>> chinese_remainder([2, 3, 2], [3, 5, 7])
+    23
+    """
+    x = 0
+    product = 1
+    for residue, modulus in zip(residues, moduli):
+        x += (residue - x) * inversemod(product, modulus) % modulus * product
+        product *= modulus
+    return x % product
+
+class CRTPlan(object):
+    """
+    Reconstructs integers from their residues modulo a
+    fixed list of moduli, which need not be coprime.  The
+    moduli are first cut down to pairwise coprime divisors
+    with the same least common multiple M, and the basis
+    of integers e_i that are 1 modulo the ith of them and
+    0 modulo the rest is computed once, so that each
+    reconstruction is a single dot product reduced mod M.
+    Examples:
+    >>> plan = CRTPlan([4, 6, 9])
+    >>> plan.modulus
+    36
+    >>> plan.residues(23)
+    (3, 5, 5)
+    >>> plan.reconstruct([3, 5, 5])
+    23
+    """
+
+    def __init__(self, moduli):
+        self.moduli = tuple(moduli)
+        assert all(m > 0 for m in self.moduli), "moduli must be positive."
+        reduced = _coprime_moduli(self.moduli)
+        self.modulus = reduce(mul, reduced, 1)
+        self.basis = []
+        for m in reduced:
+            cofactor = self.modulus / m
+            self.basis.append(cofactor * inversemod(cofactor % m, m)
+                              if m > 1 else 0)
+        # Moduli that lost factors to others, whose residues must be checked
+        # against the reconstruction.
+        self.checked = [(i, m) for i, (m, r) in
+                        enumerate(izip(self.moduli, reduced)) if m != r]
+
+    def reconstruct(self, residues):
+        """The integer between 0 and M - 1 with the given residues, one per
+        modulus.  ValueError is raised if moduli with common factors were
+        given residues that disagree, or if there are too few or too many
+        residues."""
+        self._check_length(residues)
+        x = sum(imap(mul, residues, self.basis)) % self.modulus
+        for i, m in self.checked:
+            if (x - residues[i]) % m != 0:
+                raise ValueError("Residue %d modulo %d disagrees with the "
+                                 "others." % (residues[i], m))
+        return x
+
+    def reconstruct_many(self, vectors):
+        """reconstruct of each of a sequence of residue vectors."""
+        basis = self.basis
+        modulus = self.modulus
+        if self.checked:
+            return [self.reconstruct(residues) for residues in vectors]
+        found = []
+        for residues in vectors:
+            self._check_length(residues)
+            found.append(sum(imap(mul, residues, basis)) % modulus)
+        return found
+
+    def residues(self, number):
+        """The residues of number modulo each of the moduli."""
+        return tuple(number % m for m in self.moduli)
+
+    def residues_many(self, numbers):
+        """residues of each of a sequence of integers."""
+        moduli = self.moduli
+        return [tuple(number % m for m in moduli) for number in numbers]
+
+    def _check_length(self, residues):
+        """Raise ValueError unless there is one residue per modulus."""
+        if len(residues) != len(self.moduli):
+            raise ValueError("Expected %d residues, got %d." %
+                             (len(self.moduli), len(residues)))
+
+def _coprime_moduli(moduli):
+    """Divisors of the moduli, pairwise coprime, with the same least common
+    multiple.  Each common factor of a pair is left with whichever of the
+    two holds the higher power of each of its primes, which takes only
+    gcds, not factorization."""
+    reduced = list(moduli)
+    for j in xrange(len(reduced)):
+        for i in xrange(j):
+            a = reduced[i]
+            g = gcd(a, reduced[j])
+            if g == 1:
+                continue
+            b = reduced[j] / g
+            h = gcd(a, b)
+            while h != 1:
+                a /= h
+                b *= h
+                h = gcd(a, b)
+            reduced[i], reduced[j] = a, b
+    return reduced
+
+# Size in bits above which gcd and xgcd take Lehmer steps rather than
+# Euclid steps.  Lehmer's algorithm runs the quotients of a step on the
+# leading 62 bits in machine integers, but that inner loop is interpreted,
+# so it only beats Euclid's long divisions, which run in C, on numbers of a
+# few thousand bits.
+LEHMER_THRESHOLD = 3072
 
 def gcd(a, b):
     """gcd(a, b) returns the greatest common divisor of the integers a and
-    b.
+    b, which is never negative.
     >>> gcd(97, 100)
     1
     >>> gcd(97 * 10**15, 19**20 * 97**2)              # (2)
     97L"""
-    if a == 0:
-        return b
-    if b == 0:
-        return a
-    return abs(gcd(b % a, a))
+    a = abs(a)
+    b = abs(b)
+    while b.bit_length() > LEHMER_THRESHOLD:
+        A, B, C, D = _lehmer_cofactors(a, b)
+        if B == 0:
+            a, b = b, a % b
+        else:
+            a, b = A*a + B*b, C*a + D*b
+    while b:
+        a, b = b, a % b
+    return a
+
+def gcd_many(numbers):
+    """gcd_many(numbers) - The greatest common divisor of all the integers
+    in the iterable numbers, or 0 if there are none.  Stops reading numbers
+    as soon as the divisor reaches 1.
+    >>> gcd_many([12, 18, -30])
+    6"""
+    result = 0
+    for number in numbers:
+        result = gcd(result, number)
+        if result == 1:
+            break
+    return result
 
-def factor(n):
+def lcm_many(numbers):
+    """lcm_many(numbers) - The least common multiple of all the integers in
+    the iterable numbers, or 1 if there are none.
+    >>> lcm_many([4, 6, -10])
+    60"""
+    result = 1
+    for number in numbers:
+        if number == 0:
+            return 0
+        result = result / gcd(result, number) * abs(number)
+    return result
+
+def _lehmer_cofactors(a, b):
+    """The matrix (A, B, C, D) of a Lehmer step on a, b > 0: the
+    quotients of Euclid's algorithm on the leading 62 bits of a and b that
+    are also the quotients of a and b, combined, so that A*a + B*b and
+    C*a + D*b are the remainders Euclid would reach.  B is 0 when not even
+    the first quotient is certain."""
+    shift = max(a.bit_length(), b.bit_length(), 62) - 62
+    x = int(a >> shift)
+    y = int(b >> shift)
+    A, B, C, D = 1, 0, 0, 1
+    while y + C != 0 and y + D != 0:
+        q = (x + A) // (y + C)
+        if q != (x + B) // (y + D):
+            break
+        A, C = C, A - q*C
+        B, D = D, B - q*D
+        x, y = y, x - q*y
+    return A, B, C, D
+
+# Number of factorizations factorization keeps, least recently used first
+# out.  Numbers covered by the smallest-prime-factor table are not kept, as
+# reading them from it is as quick as looking them up.
+FACTORIZATION_CACHE_SIZE = 1 << 10
+
+class Factorization(tuple):
+    """The factorization of a positive integer n, as a sorted tuple of pairs
+    (p, e) of its prime factors and their exponents.  totient,
+    modular_order, divisors, is_primitive_root and primitive_root accept
+    one in place of n, so that n need only be factored once to compute
+    several functions of it."""
+
+    def __new__(cls, pairs):
+        # Primes found by rho or ECM come back as longs; keep those that fit
+        # in a machine word as ints, as the factorization tables give them.
+        found = tuple.__new__(cls, sorted((int(p), e) for p, e in pairs))
+        found.n = reduce(mul, (p**e for p, e in found), 1)
+        return found
+
+    def __getnewargs__(self):
+        return tuple(self),
+
+    def __repr__(self):
+        return "Factorization(%r)" % list(self)
+
+    @property
+    def primes(self):
+        """The distinct prime factors of n."""
+        return [p for p, e in self]
+
+def factor(n, workers=None, timeout=None):
     """
     Returns the factorization of the integer n as
     a sorted list of tuples (p, e), where the integers p
-    are output by the split algorithm.
+    are output by the split algorithm.  If workers is
+    given, composites are split by Pollard rho walks and
+    elliptic curves run in parallel on that many
+    processes (see parallel_find_factor).
     Input:
         n -- an integer
+        workers -- (optional) a number of processes, or 0
+                   for one per CPU
+        timeout -- (optional) a limit in seconds on the
+                   parallel search; RuntimeError is
+                   raised when it runs out, or when
+                   every trial of the search fails
     Output:
         list -- factorization of n
     Examples:
@@ -106,6 +409,10 @@ def factor(n):
         return []
     if n < 0:
         n = -n
+    if n < len(_spf_table):
+        return _spf_factorization(n, _spf_table)
+    if workers is not None:
+        return _parallel_factor(n, workers, timeout)
     F = []
     while n != 1:
         p = trial_division(n)
@@ -118,16 +425,121 @@ def factor(n):
     F.sort()
     return F
 
+def factorization(number):
+    """
+    Returns the Factorization of the positive integer
+    number, from a cache of the most recently used ones.
+    A Factorization is returned as it is.
+    Input:
+        number -- a positive integer or a Factorization
+    Output:
+        Factorization -- the factorization of number
+    Examples:
+    >>> factorization(2004)
+    Factorization([(2, 2), (3, 1), (167, 1)])
+    >>> totient(factorization(2004))
+    664
+    """
+    if isinstance(number, Factorization):
+        return number
+    if number < 1:
+        raise ValueError(number)
+    if number < len(_spf_table):
+        return Factorization(_spf_factorization(number, _spf_table))
+    try:
+        found = _factorizations.pop(number)
+    except KeyError:
+        found = Factorization((p, len(list(group))) for p, group
+                              in groupby(prime_factors(number)))
+        if len(_factorizations) >= FACTORIZATION_CACHE_SIZE:
+            _factorizations.popitem(last=False)
+    _factorizations[number] = found
+    return found
+
+# Factorizations kept by factorization, most recently used last.
+_factorizations = OrderedDict()
+
 def find_one_prime_factor(number):
-    """find_one_prime_factor(number) - Find a prime find_one_prime_factor of number
-    using a variety of methods."""
+    """find_one_prime_factor(number) - Find a prime factor of number > 1
+    using a variety of methods: trial division, a bounded Pollard rho for
+    factors of up to about a dozen digits, then the elliptic curve method for
+    factors of up to 40 digits, and finally an unbounded Pollard rho."""
     if is_prime(number):
         return number
-    for fact in [2, 3, 5, 7, 11, 13, 17, 19, 23, 29]:
+    for fact in _SMALL_PRIMES:
         if number % fact == 0:
             return fact
-    # TODO No guarantee that a prime find_one_prime_factor will be returned
-    return pollard_rho(number)
+    fact = pollard_rho(number, RHO_STEP_LIMIT)
+    if fact == number:
+        fact = ecm_factor(number)
+    if fact == number:
+        fact = pollard_rho(number)
+    return find_one_prime_factor(fact)
+
+def inversemod(a, n):
+    """
+    Returns the inverse of a modulo n, normalized to
+    lie between 0 and n-1.  If a is not coprime to n,
+    raise an exception (this will be useful later for
+    the elliptic curve factorization method).
+    Input:
+        a -- an integer coprime to n
+        n -- a positive integer
+    Output:
+        an integer between 0 and n-1.
+    Examples:
+    >>> inversemod(1, 1)
+    0
+    >>> inversemod(2, 5)
+    3
+    >>> inversemod(5, 8)
+    5
+    >>> inversemod(37, 100)
+    73
+    """
+    g, x, _ = xgcd(a, n)
+    if g != 1:
+        raise ZeroDivisionError(a, n)
+    return x % n
+
+def batch_inverse(values, modulus):
+    """
+    Returns the inverses of all the values modulo modulus,
+    by Montgomery's trick: the running products of the
+    values are inverted with a single call to inversemod,
+    and 3(k-1) multiplications unpick the k inverses from
+    that one.
+    Input:
+        values -- a sequence of integers coprime to modulus
+        modulus -- a positive integer
+    Output:
+        list -- a list of integers between 0 and modulus-1.
+    If some value is not coprime to modulus, raise
+    ZeroDivisionError(value, modulus) for the first such
+    value, as inversemod would.
+    Examples:
+    >>> batch_inverse([2, 3, 4], 7)
+    [4, 5, 2]
+    """
+    values = [value % modulus for value in values]
+    if not values:
+        return []
+    products = [values[0]]
+    for value in values[1:]:
+        products.append(products[-1] * value % modulus)
+    try:
+        inverse = inversemod(products[-1], modulus)
+    except ZeroDivisionError:
+        for value in values:
+            if gcd(value, modulus) != 1:
+                raise ZeroDivisionError(value, modulus)
+        raise
+    inverses = [0] * len(values)
+    for i in xrange(len(values) - 1, 0, -1):
+        inverses[i] = inverse * products[i - 1] % modulus
+        inverse = inverse * values[i] % modulus
+    inverses[0] = inverse
+    return inverses
 
 def is_euler_prime(number, base):
     """is_euler_prime(number) - Test whether number is prime or an Euler
@@ -152,29 +564,64 @@ def is_fermat_prime(number, base):
     pseudoprime to base base."""
     return (pow(base, number-1, number) == 1)
 
+# Primes tried by trial division before any pseudoprime test in is_prime.
+_SMALL_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53,
+                 59, 61, 67, 71, 73, 79, 83, 89, 97)
+
+# The strong pseudoprime test to these bases is exact for every number below
+# 2**64 (Jim Sinclair's seven-base set).
+_MILLER_RABIN_BASES_64 = (2, 325, 9375, 28178, 450775, 9780504, 1795265022)
+
 def is_prime(number):
-    """is_prime(number) - Test whether number is prime using a variety of
-    pseudoprime tests."""
-    if number in [2, 3, 5, 7, 11, 13, 17, 19, 23, 29]:
+    """
+    Test whether number is prime.  After trial division
+    by the primes below 100, numbers below 2**64 get the
+    strong pseudoprime test to a base set known to be
+    exact there, and larger numbers get the Baillie-PSW
+    test (a strong pseudoprime test to base 2 and a
+    strong Lucas test), which has no known
+    counterexample.  The answer never depends on chance.
+    Input:
+        number -- an integer
+    Output:
+        bool
+    Examples:
+    >>> is_prime(97)
+    True
+    >>> is_prime(3215031751)   # strong pseudoprime to bases 2, 3, 5, 7
+    False
+    >>> is_prime(2**89 - 1)
+    True
+    """
+    if number < 2:
+        return False
+    for p in _SMALL_PRIMES:
+        if number % p == 0:
+            return number == p
+    if number < _SMALL_PRIMES[-1] ** 2:
         return True
-    return (is_euler_prime(number, 2) and is_euler_prime(number, 3) and
-            is_euler_prime(number, 5))
+    if number < 1 << 64:
+        for base in _MILLER_RABIN_BASES_64:
+            base %= number
+            if base != 0 and not is_strong_pseudoprime(number, base):
+                return False
+        return True
+    return (is_strong_pseudoprime(number, 2) and
+            _is_strong_lucas_pseudoprime(number))
 
 def is_primitive_root(candidate, modulus):
     """is_primitive_root(candidate, modulus) - Test whether candidate is
-    primitive - generates the group of units mod modulus."""
-    if gcd(candidate, modulus) != 1:
+    primitive - generates the group of units mod modulus, which may be given
+    as a Factorization."""
+    modulus = factorization(modulus)
+    if gcd(candidate, modulus.n) != 1:
         return False  # Not in the group of units
     order = totient(modulus)
     if modular_order(modulus) != order:
         return False # Group of units isn't cyclic
-    orderfacts = prime_factors(order)
-    oldfact = 1
-    for fact in orderfacts:
-        if fact != oldfact:
-            if pow(candidate, order/fact, modulus) == 1:
-                return False
-            oldfact = fact
+    for fact in _totient_factorization(modulus).primes:
+        if pow(candidate, order/fact, modulus.n) == 1:
+            return False
     return True
 
 def is_pseudoprime(n, bases=(2, 3, 5, 7)):
@@ -215,100 +662,116 @@ def is_pseudoprime(n, bases=(2, 3, 5, 7)):
             return False
     return True
 
+def is_strong_pseudoprime(number, base):
+    """is_strong_pseudoprime(number, base) - Test whether the odd number
+    number > 2 is prime or a strong pseudoprime to base base, the test
+    underlying the Miller-Rabin method."""
+    odd_part = number - 1
+    twos = 0
+    while odd_part % 2 == 0:
+        odd_part /= 2
+        twos += 1
+    c = pow(base, odd_part, number)
+    if c == 1 or c == number - 1:
+        return True
+    for _ in xrange(twos - 1):
+        c = c * c % number
+        if c == number - 1:
+            return True
+    return False
+
+def _is_strong_lucas_pseudoprime(number):
+    """Test whether the odd number number > 2 is prime or a strong Lucas
+    pseudoprime, with the parameters chosen by Selfridge's method A: D is the
+    first of 5, -7, 9, -11, ... with jacobi(D, number) == -1, P = 1 and
+    Q = (1 - D)/4."""
+    root = integer_sqrt(number)
+    if root * root == number:
+        return False  # No suitable D exists for a perfect square
+    D = 5
+    while True:
+        symbol = jacobi(D, number)
+        if symbol == -1:
+            break
+        if symbol == 0 and abs(D) != number:
+            return False
+        D = -D - 2 if D > 0 else -D + 2
+    Q = (1 - D) / 4
+    odd_part = number + 1
+    twos = 0
+    while odd_part % 2 == 0:
+        odd_part /= 2
+        twos += 1
+    # Walk the bits of odd_part, keeping U_k, V_k and Q**k modulo number.
+    U, V, Qk = 1, 1, Q % number
+    for bit in bin(odd_part)[3:]:
+        U, V = U * V % number, (V * V - 2 * Qk) % number
+        Qk = Qk * Qk % number
+        if bit == "1":
+            U, V = U + V, D * U + V
+            if U % 2:
+                U += number
+            if V % 2:
+                V += number
+            U, V = U / 2 % number, V / 2 % number
+            Qk = Qk * Q % number
+    if U == 0 or V == 0:
+        return True
+    for _ in xrange(twos - 1):
+        V = (V * V - 2 * Qk) % number
+        if V == 0:
+            return True
+        Qk = Qk * Qk % number
+    return False
+
 def miller_rabin(n, num_trials=4):
     """
-    True if n is likely prime, and False if n
-    is definitely not prime.  Increasing num_trials
-    increases the probability of correctness.
-    (One can prove that the probability that this
-    function returns True when it should return
-    False is at most (1/4)**num_trials.)
+    True if n is prime, and False if it is not.  This
+    once ran num_trials rounds of the Miller-Rabin test
+    to random bases; it now runs the deterministic test
+    of is_prime, which should be called directly.
     Input:
         n -- an integer
-        num_trials -- the number of trials with the
-                      primality test.
+        num_trials -- ignored, kept for old callers
     Output:
-        bool -- whether or not n is probably prime.
+        bool -- whether or not n is prime.
     Examples:
     >>> miller_rabin(91)
-    False                         #rand
-    >>> miller_rabin(97)
-    True                          #rand
+    False
+    >>> miller_rabin(-97)
+    True
     >>> s = [x for x in range(1000) if miller_rabin(x, 1)]
-    >>> t = primes(1000)
-    >>> print len(s), len(t)  # so 1 in 25 wrong
-    175 168                       #rand
-    >>> s = [x for x in range(1000) if miller_rabin(x)]
-    >>> s == t
-    True                          #rand
+    >>> s == primes(1000)
+    True
     """
-    if n < 0:
-        n = -n
-    if n in [2, 3]:
-        return True
-    if n <= 4:
-        return False
-    m = n - 1
-    k = 0
-    while m % 2 == 0:
-        k += 1
-        m /= 2
-    # Now n - 1 = (2**k) * m with m odd
-    for i in xrange(num_trials):
-        a = randrange(2, n-1)                  # (1)
-        apow = powermod(a, m, n)
-        if not (apow in [1, n-1]):
-            some_minus_one = False
-            for j in range(k-1):              # (2)
-                apow = (apow**2) % n
-                if apow == n-1:
-                    some_minus_one = True
-                    break                     # (3)
-        if (apow in [1, n-1]) or some_minus_one:
-            prob_prime = True
-        else:
-            return False
-    return True
+    return is_prime(abs(n))
 
 def modular_order(number):
     """modular_order(number) - Computer Carmichael's Lambda function of number
     - the smallest exponent e such that b**e = 1 for all b coprime to number.
-    Otherwise defined as the exponent of the group of integers mod number."""
-    thefactors = prime_factors(number)
-    thefactors.sort()
-    thefactors += [0]  # Mark the end of the list of factors
+    Otherwise defined as the exponent of the group of integers mod number.
+    number may be given as a Factorization."""
     carlambda = 1 # The Carmichael Lambda function of number
-    carlambda_comp = 1 # The Carmichael Lambda function of the component p**e
-    oldfact = 1
-    for fact in thefactors:
-        if fact == oldfact:
-            carlambda_comp = (carlambda_comp*fact)
+    for fact, power in factorization(number):
+        if fact == 2 and power >= 3:
+            carlambda_comp = 2**(power-2) # Z_(2**e) is not cyclic for e>=3
         else:
-            if (oldfact == 2) and (carlambda_comp >= 4):
-                carlambda_comp /= 2 # Z_(2**e) is not cyclic for e>=3
-            if carlambda == 1:
-                carlambda = carlambda_comp
-            else:
-                div = gcd(carlambda, carlambda_comp)
-                carlambda = (carlambda * carlambda_comp)/ div
-            carlambda_comp = fact-1
-            oldfact = fact
+            carlambda_comp = fact**(power-1) * (fact-1)
+        carlambda = carlambda * carlambda_comp / gcd(carlambda, carlambda_comp)
     return carlambda
 
 def modular_power(base, exponent, modulus):
     """modular_power(base, exponent, modulus) computes the eth power of base
-    mod modulus.  (Actually, this is not needed, as pow(base, exponent,
-    modulus) does the same thing for positive integers.  This will be useful in
-    future for non-integers or inverses."""
-    accum = 1
-    i = 0
-    bpow2 = base
-    while (exponent>>i) > 0:
-        if (exponent>>i) & 1:
-            accum = (accum*bpow2) % modulus
-        bpow2 = (bpow2*bpow2) % modulus
-        i += 1
-    return accum
+    mod modulus.  Integers go to pow(base, exponent, modulus); a negative
+    exponent raises the inverse of base instead, and any other base with *
+    and % is raised by sliding_window_power."""
+    if exponent < 0:
+        base = inversemod(base, modulus)
+        exponent = -exponent
+    if isinstance(base, (int, long)):
+        return pow(base, exponent, modulus)
+    return sliding_window_power(base, exponent,
+                                lambda x, y: x * y % modulus) % modulus
 
 def lcm_to(B):
     """
@@ -328,17 +791,116 @@ def lcm_to(B):
     """
     ans = 1
     logB = log(B)
-    for p in primes(B):
+    for p in _prime_table.up_to(B):
         ans *= p**int(logB/log(p))
     return ans
 
+def jacobi(a, n):
+    """
+    Returns the Jacobi symbol a over n, for any odd n,
+    prime or not, computed by quadratic reciprocity
+    without any exponentiation: each step strips the
+    factors of two from a with one shift, reading the
+    sign of (2/n) from the low bits of n, then swaps a
+    and n and reduces, like a step of Euclid's algorithm.
+    Input:
+        a -- an integer
+        n -- a positive odd integer
+    Output:
+        int -- -1, 0 or 1
+    Examples:
+    >>> jacobi(2, 5)
+    -1
+    >>> jacobi(1001, 9907)
+    -1
+    """
+    assert n > 0 and n % 2 == 1, "n must be a positive odd integer."
+    a %= n
+    result = 1
+    while a != 0:
+        twos = (a & -a).bit_length() - 1
+        a >>= twos
+        if twos & 1 and n & 7 in (3, 5):
+            result = -result
+        if a & n & 2:
+            result = -result
+        a, n = n % a, a
+    if n == 1:
+        return result
+    return 0
+
+def jacobi_many(values, n):
+    """
+    Returns the Jacobi symbols a over n of all the values
+    a, as jacobi does, with the loop inlined.
+    Input:
+        values -- a sequence of integers
+        n -- a positive odd integer
+    Output:
+        list -- a list of -1, 0 and 1
+    Examples:
+    >>> jacobi_many([1, 2, 3, 4, 5], 5)
+    [1, -1, -1, 1, 0]
+    """
+    assert n > 0 and n % 2 == 1, "n must be a positive odd integer."
+    symbols = []
+    for a in values:
+        a %= n
+        m = n
+        result = 1
+        while a != 0:
+            twos = (a & -a).bit_length() - 1
+            a >>= twos
+            if twos & 1 and m & 7 in (3, 5):
+                result = -result
+            if a & m & 2:
+                result = -result
+            a, m = m % a, a
+        symbols.append(result if m == 1 else 0)
+    return symbols
+
+def kronecker(a, n):
+    """
+    Returns the Kronecker symbol a over n, which extends
+    the Jacobi symbol to every integer n: (a/2) is 0 for
+    even a, 1 for a == 1 or 7 (mod 8) and -1 otherwise,
+    (a/-1) is the sign of a, and (a/0) is 1 for a = 1 or
+    -1 and 0 otherwise.
+    Input:
+        a -- an integer
+        n -- an integer
+    Output:
+        int -- -1, 0 or 1
+    Examples:
+    >>> kronecker(3, 8)
+    -1
+    >>> kronecker(-5, -12)
+    -1
+    """
+    if n == 0:
+        return 1 if abs(a) == 1 else 0
+    result = 1
+    if n < 0:
+        n = -n
+        if a < 0:
+            result = -1
+    twos = (n & -n).bit_length() - 1
+    if twos:
+        if a % 2 == 0:
+            return 0
+        n >>= twos
+        if twos & 1 and a & 7 in (3, 5):
+            result = -result
+    return result * jacobi(a, n)
+
 def legendre(a, p):
     """
     Returns the Legendre symbol a over p, where
-    p is an odd prime.
+    p is an odd prime, which is the Jacobi symbol.
     Input:
         a -- an integer
-        p -- an odd prime (primality not checked)
+        p -- an odd prime (primality not checked), or its
+             Factorization
     Output:
         int: -1 if a is not a square mod p,
               0 if gcd(a, p) is not 1
@@ -351,13 +913,10 @@ def legendre(a, p):
     >>> legendre(7, 2003)
     -1
     """
+    if isinstance(p, Factorization):
+        p = p.n
     assert p % 2 == 1, "p must be an odd prime."
-    b = powermod(a, (p-1)/2, p)
-    if b == 1:
-        return 1
-    elif b == p-1:
-        return -1
-    return 0
+    return jacobi(a, p)
 
 def pollard(N, m):
     """
@@ -392,25 +951,65 @@ def pollard(N, m):
             return g
     return N
 
-def pollard_rho(number):
-    """pollard_rho(number) - Find a find_one_prime_factor of number using the
-    Pollard Rho method.  Note: This method will occasionally fail."""
-    for slow in [2, 3, 4, 6]:
-        numsteps = 2 * floor(sqrt(sqrt(number)))
-        fast = slow
-        i = 1
-        while i < numsteps:
-            slow = (slow*slow + 1) % number
-            i = i + 1
-            fast = (fast*fast + 1) % number
-            fast = (fast*fast + 1) % number
-            g = gcd(fast-slow, number)
-            if g != 1:
-                if g == number:
-                    break
-                else:
-                    return g
-    return 1
+# Number of steps of pollard_rho whose differences are multiplied together
+# before each gcd.
+RHO_BATCH_SIZE = 128
+
+# Steps find_one_prime_factor allows Pollard rho before it turns to the
+# elliptic curve method.
+RHO_STEP_LIMIT = 1 << 16
+
+def pollard_rho(number, max_steps=None):
+    """
+    Use Brent's variant of the Pollard Rho method to find
+    a nontrivial divisor of the odd composite number.
+    The differences from RHO_BATCH_SIZE steps are
+    multiplied together before each gcd.  A walk that
+    collapses onto number itself is replaced by one with
+    fresh random constants, so the search only gives up
+    once max_steps steps have been taken in total.
+    Input:
+        number -- an odd composite integer
+        max_steps -- (optional) a positive integer
+    Output:
+        int -- a nontrivial divisor of number, or number
+               if max_steps is exhausted
+    Examples:
+    >>> pollard_rho(10403)
+    101       #rand
+    """
+    if number % 2 == 0:
+        return 2
+    steps = 0
+    while max_steps is None or steps < max_steps:
+        c = randrange(1, number - 2)
+        y = randrange(number)
+        g = r = q = 1
+        while g == 1:
+            x = y
+            for _ in xrange(r):
+                y = (y*y + c) % number
+            k = 0
+            while k < r and g == 1:
+                saved = y
+                for _ in xrange(min(RHO_BATCH_SIZE, r - k)):
+                    y = (y*y + c) % number
+                    q = q * (x - y) % number
+                g = gcd(q, number)
+                k += RHO_BATCH_SIZE
+            steps += 2 * r
+            r *= 2
+            if max_steps is not None and steps >= max_steps:
+                break
+        if g == number:
+            # The batch overshot; repeat its steps one gcd at a time.
+            g = 1
+            while g == 1:
+                saved = (saved*saved + c) % number
+                g = gcd(x - saved, number)
+        if 1 < g < number:
+            return g
+    return number
 
 def powermod(a, m, n):
     """
@@ -429,23 +1028,19 @@ def powermod(a, m, n):
     """
     assert m >= 0, "m must be nonnegative."   # (1)
     assert n >= 1, "n must be positive."      # (2)
-    ans = 1
-    apow = a
-    while m != 0:
-        if m % 2 != 0:
-            ans = (ans * apow) % n            # (3)
-        apow = (apow * apow) % n              # (4)
-        m /= 2
-    return ans % n
+    return pow(a, m, n)                       # (3)
 
 def prime_factors(number):
     """factors(number) - Return a sorted list of the prime factors of
     number."""
+    if number == 1:
+        return []
+    if number < len(_spf_table):
+        return [p for p, e in _spf_factorization(number, _spf_table)
+                for _ in xrange(e)]
     if is_prime(number):
         return [number]
     fact = find_one_prime_factor(number)
-    if fact == 1:
-        return "Unable to find_one_prime_factor "+str(number)
     facts = prime_factors(number/fact) + prime_factors(fact)
     facts.sort()
     return facts
@@ -456,24 +1051,28 @@ def prime_factorization(number):
         raise ValueError
     elif number in (0, 1):
         return []
-    root = int(sqrt(number))
-    found = _prime_factorization(number, iter(primes(root)))
+    elif number < len(_spf_table):
+        return _spf_factorization(number, _spf_table)
+    root = integer_sqrt(number)
+    found = _prime_factorization(number, _prime_table.up_to(root))
     if len(found) == 0:
         found = [(number, 1)]
     return found
 
 def _prime_factorization(number, generator):
-    while True:
-        try:
-            prime = next(generator)
-        except StopIteration:
-            return [(number, 1)] if number != 1 else []
+    found = []
+    for prime in generator:
+        if prime * prime > number:
+            break
         if number % prime == 0:
             power = 0
             while number % prime == 0:
                 power += 1
                 number /= prime
-            return [(prime, power)] + _prime_factorization(number, generator)
+            found.append((prime, power))
+    if number != 1:
+        found.append((number, 1))
+    return found
 
 def primes(n):
     """
@@ -489,16 +1088,10 @@ def primes(n):
     >>> primes(45)
     [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43]
     """
-    if n <= 1:
-        return []
-    X = [i for i in range(3, n+1) if i % 2 != 0]
-    P = [2]
-    sqrt_n = sqrt(n)
-    while len(X) > 0 and X[0] <= sqrt_n:
-        p = X[0]
-        P.append(p)
-        X = [a for a in X if a % p != 0]
-    return P + X
+    return list(iter_primes(n))
+
+# Number of candidates whose Jacobi symbols primitive_root computes at a time.
+PRIMITIVE_ROOT_BATCH_SIZE = 64
 
 def primitive_root(p):
     """
@@ -506,7 +1099,8 @@ def primitive_root(p):
     (If p is not prime, this return value of this function
     is not meaningful.)
     Input:
-        p -- an integer that is assumed prime
+        p -- an integer that is assumed prime, or its
+             Factorization
     Output:
         int -- a primitive root modulo p
     Examples:
@@ -517,19 +1111,22 @@ def primitive_root(p):
     >>> primitive_root(5881)
     31
     """
+    if isinstance(p, Factorization):
+        p = p.n
     if p == 2:
         return 1
-    F = factor(p-1)
-    a = 2
-    while a < p:
-        generates = True
-        for q, _ in F:
-            if powermod(a, (p-1)/q, p) == 1:
-                generates = False
-                break
-        if generates:
-            return a
-        a += 1
+    # A primitive root is a quadratic non-residue, so the Jacobi symbols of
+    # a batch of candidates rule out half of them without any powers, and
+    # only the odd prime factors of p - 1 remain to be tried.
+    odd_factors = [q for q in factorization(p-1).primes if q != 2]
+    start = 2
+    while start < p:
+        candidates = range(start, min(start + PRIMITIVE_ROOT_BATCH_SIZE, p))
+        for a, symbol in izip(candidates, jacobi_many(candidates, p)):
+            if symbol == -1 and \
+               all(powermod(a, (p-1)/q, p) != 1 for q in odd_factors):
+                return a
+        start += PRIMITIVE_ROOT_BATCH_SIZE
     assert False, "p must be prime."
 
 def power_of_factor(number, factor):
@@ -541,6 +1138,14 @@ def power_of_factor(number, factor):
         number /= factor
     return power
 
+def quadratic_non_residue(p):
+    """quadratic_non_residue(p) - The least integer that is not a square
+    modulo the odd prime p."""
+    z = 2
+    while jacobi(z, p) != -1:
+        z += 1
+    return z
+
 def solve_linear(a, b, n):
     """
     If the equation ax = b (mod n) has a solution, return a
@@ -563,9 +1168,19 @@ def solve_linear(a, b, n):
         return None
     return ((b/g)*c) % n
 
+# Number of primes whose Tonelli-Shanks parameters sqrtmod keeps.
+SQRT_PARAMETER_CACHE_SIZE = 1 << 6
+
+# Tonelli-Shanks parameters (s, q, c) for the primes sqrtmod was last called
+# with, most recently used last: p - 1 = q * 2**s with q odd, and c = z**q for
+# the least quadratic non-residue z modulo p.
+_sqrt_parameters = OrderedDict()
+
 def sqrtmod(a, p):
     """
-    Returns a square root of a modulo p.
+    Returns a square root of a modulo p, by the
+    Tonelli-Shanks algorithm, or by a single
+    exponentiation when p == 3 (mod 4).
     Input:
         a -- an integer that is a perfect
              square modulo p (this is checked)
@@ -575,57 +1190,93 @@ def sqrtmod(a, p):
                between 0 and p-1.
     Examples:
     >>> sqrtmod(4, 5)              # p == 1 (mod 4)
-    3              #rand
+    3
     >>> sqrtmod(13, 23)            # p == 3 (mod 4)
-    6              #rand
+    6
     >>> sqrtmod(997, 7304723089)   # p == 1 (mod 4)
-    761044645L     #rand
+    761044645
     """
     a %= p
     if p == 2:
         return a
-    assert legendre(a, p) == 1, "a must be a square mod p."
-    if p % 4 == 3:
-        return powermod(a, (p+1)/4, p)
-
-    modmul = lambda x, y: ((x[0]*y[0] + a*y[1]*x[1]) % p,
-                           (x[0]*y[1] + x[1]*y[0]) % p)
-    def modpow(x, n):   # exponentiation in R       # (2)
-        ans = (1, 0)
-        xpow = x
-        while n != 0:
-            if n % 2 != 0:
-                ans = modmul(ans, xpow)
-            xpow = modmul(xpow, xpow)
-            n /= 2
-        return ans
+    assert jacobi(a, p) == 1, "a must be a square mod p."
+    return _tonelli_shanks(a, p)
 
-    while True:
-        z = randrange(2, p)
-        u, v = modpow((1, z), (p-1)/2)
-        if v != 0:
-            vinv = inversemod(v, p)
-            for x in [-u*vinv, (1-u)*vinv, (-1-u)*vinv]:
-                if (x*x) % p == a:
-                    return x % p
-            assert False, "Bug in sqrtmod."
+def sqrtmod_many(values, p):
+    """
+    Returns square roots modulo p of all the values, as
+    sqrtmod does, setting up the Tonelli-Shanks
+    parameters for p only once.
+    Input:
+        values -- a sequence of integers that are
+                  squares modulo p (not checked)
+        p -- a prime
+    Output:
+        list -- a list of integers between 0 and p-1
+    Examples:
+    >>> sqrtmod_many([4, 9, 5], 11)
+    [9, 3, 4]
+    """
+    if p == 2:
+        return [value % p for value in values]
+    return [_tonelli_shanks(value % p, p) for value in values]
+
+def _tonelli_shanks(a, p):
+    """A square root of the square a, between 0 and p-1, modulo the odd
+    prime p.  Roots that fit in a machine word are returned as ints, though
+    the cached non-residue power is often a long."""
+    if a == 0:
+        return 0
+    if p % 4 == 3:
+        return int(pow(a, (p + 1) / 4, p))
+    try:
+        parameters = _sqrt_parameters.pop(p)
+    except KeyError:
+        q = p - 1
+        s = (q & -q).bit_length() - 1
+        q >>= s
+        parameters = (s, q, pow(quadratic_non_residue(p), q, p))
+        if len(_sqrt_parameters) >= SQRT_PARAMETER_CACHE_SIZE:
+            _sqrt_parameters.popitem(last=False)
+    _sqrt_parameters[p] = parameters
+    m, q, c = parameters
+    w = pow(a, (q - 1) / 2, p)
+    x = a * w % p                       # a**((q+1)/2)
+    t = x * w % p                       # a**q, of order 2**i for some i < m
+    while t != 1:
+        i = 1
+        square = t * t % p
+        while square != 1:
+            square = square * square % p
+            i += 1
+        b = pow(c, 1 << (m - i - 1), p)
+        x = x * b % p
+        c = b * b % p
+        t = t * c % p
+        m = i
+    return int(x)
 
 def totient(number):
     """totient(number) - Computer Euler's Phi function of number - the number
     of integers strictly less than number which are coprime to number.
-    Otherwise defined as the order of the group of integers mod number."""
-    thefactors = prime_factors(number)
-    thefactors.sort()
+    Otherwise defined as the order of the group of integers mod number.
+    number may be given as a Factorization."""
     phi = 1
-    oldfact = 1
-    for fact in thefactors:
-        if fact == oldfact:
-            phi = phi*fact
-        else:
-            phi = phi*(fact-1)
-            oldfact = fact
+    for fact, power in factorization(number):
+        phi *= fact**(power-1) * (fact-1)
     return phi
 
+def _totient_factorization(number):
+    """The Factorization of totient(number), put together from the
+    factorizations of p - 1 for the primes p dividing number."""
+    exponents = {}
+    for fact, power in factorization(number):
+        if power > 1:
+            exponents[fact] = exponents.get(fact, 0) + power - 1
+        for q, e in factorization(fact - 1):
+            exponents[q] = exponents.get(q, 0) + e
+    return Factorization(exponents.iteritems())
+
 def trial_division(n, bound=None):
     """
     Return the smallest prime divisor <= bound of the
@@ -638,22 +1289,18 @@ def trial_division(n, bound=None):
         int -- a prime p<=bound that divides n, or n if
                there is no such prime.
     Examples:
+    >>> trial_division(91)
+    7
     """
+    if n < 1:
+        raise ValueError("%d is not a positive integer." % n)
     if n == 1:
         return 1
-    for p in [2, 3, 5]:
-        if n % p == 0:
-            return p
     if bound == None:
         bound = n
-    dif = [6, 4, 2, 4, 2, 4, 6, 2]
-    m = 7
-    i = 1
-    while m <= bound and m*m <= n:
-        if n % m == 0:
-            return m
-        m += dif[i % 8]
-        i += 1
+    for p in _prime_table.up_to(min(bound, integer_sqrt(n))):
+        if n % p == 0:
+            return p
     return n
 
 def xgcd(a, b):
@@ -691,15 +1338,1495 @@ def xgcd(a, b):
     if b < 0:
         b = -b
         y_sign = -1
+    a0 = a
+    b0 = b
+    # Only the cofactor x of a is carried along; a = x*a0 + y*b0 gives y.
     x = 1
-    y = 0
     r = 0
-    s = 1
+    while b.bit_length() > LEHMER_THRESHOLD:
+        A, B, C, D = _lehmer_cofactors(a, b)
+        if B == 0:
+            q, c = divmod(a, b)
+            a, b = b, c
+            x, r = r, x - q*r
+        else:
+            a, b = A*a + B*b, C*a + D*b
+            x, r = A*x + B*r, C*x + D*r
     while b != 0:
-        (c, q) = (a % b, a/b)
-        (a, b, r, s, x, y) = (b, c, x-q*r, y-q*s, r, s)
+        q, c = divmod(a, b)
+        a, b = b, c
+        x, r = r, x - q*r
+    y = (a - x*a0) / b0
     return (a, x*x_sign, y*y_sign)
 
+##################################################
+## Modular Exponentiation
+##################################################
+
+# pow(base, exponent, modulus) is the fastest way to compute a single power
+# of an integer.  The routines here cover what it cannot do: powers in
+# other rings, powers of one base to many exponents, and products of
+# powers.
+
+class FixedBasePower(object):
+    """Powers of one base modulo one modulus.  The table holds
+    base**(d * 2**(width*i)) for every width-bit digit d and digit position
+    i, so a power costs one multiplication per nonzero digit of the exponent
+    and no squarings.  Worth it once the same base is raised many times, as
+    with a Diffie-Hellman generator."""
+
+    def __init__(self, base, modulus, max_bits=None, width=6):
+        if max_bits is None:
+            max_bits = modulus.bit_length()
+        self.base = base % modulus
+        self.modulus = modulus
+        self.max_bits = max_bits
+        self.width = width
+        self.table = []
+        power = self.base
+        for _ in xrange((max_bits + width - 1) / width):
+            row = [1, power]
+            for _ in xrange((1 << width) - 2):
+                row.append(row[-1] * power % modulus)
+            self.table.append(row)
+            power = row[-1] * power % modulus
+
+    def __call__(self, exponent):
+        """The exponent-th power of the base.  Exponents wider than the
+        table fall back to pow."""
+        assert exponent >= 0, "exponent must be nonnegative."
+        if exponent.bit_length() > self.max_bits:
+            return pow(self.base, exponent, self.modulus)
+        modulus = self.modulus
+        mask = (1 << self.width) - 1
+        result = 1
+        for row in self.table:
+            if exponent == 0:
+                break
+            digit = exponent & mask
+            if digit:
+                result = result * row[digit] % modulus
+            exponent >>= self.width
+        return result % modulus
+
+def multi_powermod(bases, exponents, modulus, width=4):
+    """
+    Returns the product of base**exponent over the given
+    bases and exponents modulo modulus, by Straus's
+    interleaved window method: the squarings are shared
+    by all the bases, so k powers cost little more than
+    one.
+    Input:
+        bases -- a sequence of integers
+        exponents -- a sequence of nonnegative integers
+        modulus -- a positive integer
+        width -- (optional) window width in bits
+    Output:
+        int -- an integer between 0 and modulus-1
+    Examples:
+    >>> multi_powermod([2, 3], [10, 5], 1000)
+    832
+    """
+    mask = (1 << width) - 1
+    tables = []
+    for base in bases:
+        row = [1, base % modulus]
+        for _ in xrange(mask - 1):
+            row.append(row[-1] * base % modulus)
+        tables.append(row)
+    digits = (max([0] + [e.bit_length() for e in exponents]) + width - 1) \
+             / width
+    result = 1
+    for position in xrange(digits - 1, -1, -1):
+        if result != 1:
+            for _ in xrange(width):
+                result = result * result % modulus
+        shift = position * width
+        for row, exponent in zip(tables, exponents):
+            digit = (exponent >> shift) & mask
+            if digit:
+                result = result * row[digit] % modulus
+    return result % modulus
+
+def sliding_window_power(x, exponent, multiply, identity=1, width=None):
+    """
+    Returns x**exponent for the associative product
+    multiply, by left-to-right sliding-window
+    exponentiation: the odd powers x, x**3, ...,
+    x**(2**width - 1) are computed first, and then each
+    window of the exponent costs one product besides the
+    squarings.
+    Input:
+        x -- an element of any monoid
+        exponent -- a nonnegative integer
+        multiply -- a function of two elements
+        identity -- (optional) the identity element,
+                    returned for exponent 0
+        width -- (optional) window width in bits, chosen
+                 from the size of the exponent by default
+    Output:
+        the element x**exponent
+    Examples:
+    >>> sliding_window_power(3, 13, lambda x, y: x * y % 100)
+    23
+    """
+    assert exponent >= 0, "exponent must be nonnegative."
+    if exponent == 0:
+        return identity
+    bits = bin(exponent)[2:]
+    if width is None:
+        width = _window_width(len(bits))
+    odd_powers = [x]
+    if width > 1:
+        square = multiply(x, x)
+        for _ in xrange((1 << (width - 1)) - 1):
+            odd_powers.append(multiply(odd_powers[-1], square))
+    result = None
+    i = 0
+    while i < len(bits):
+        if bits[i] == "0":
+            result = multiply(result, result)
+            i += 1
+            continue
+        j = min(i + width, len(bits))
+        while bits[j - 1] == "0":
+            j -= 1
+        window = odd_powers[int(bits[i:j], 2) >> 1]
+        if result is None:
+            result = window
+        else:
+            for _ in xrange(j - i):
+                result = multiply(result, result)
+            result = multiply(result, window)
+        i = j
+    return result
+
+def _window_width(bits):
+    """Window width minimizing the cost of sliding_window_power for an
+    exponent of the given length."""
+    for width, limit in [(1, 8), (2, 24), (3, 80), (4, 240), (5, 672)]:
+        if bits <= limit:
+            return width
+    return 6
+
+##################################################
+## Discrete Logarithms
+##################################################
+
+# Largest number of baby steps discrete_log stores for one prime-order
+# subgroup.  Larger subgroups are searched by Pollard's kangaroo method,
+# which needs only a few numbers of memory but about twice the steps.
+BSGS_TABLE_LIMIT = 1 << 20
+
+def discrete_log(g, h, p, order=None):
+    """
+    Returns the least x >= 0 with g**x = h (mod p), by
+    the Pohlig-Hellman reduction to the subgroups of
+    prime order q dividing the order of g, each of which
+    is searched by baby-step giant-step, or by Pollard's
+    kangaroo method when sqrt(q) baby steps would not
+    fit in BSGS_TABLE_LIMIT.
+    Input:
+        g, h -- integers coprime to p
+        p -- a prime, or any modulus if order is given
+        order -- (optional) a multiple of the order of g
+                 modulo p, or its Factorization; by
+                 default p - 1
+    Output:
+        int -- the discrete logarithm of h to the base g
+    Raises ValueError if h is not a power of g.
+    Examples:
+    >>> discrete_log(2, 3, 11)
+    8
+    >>> discrete_log(37, 7, 2**61 - 1)
+    979531769749636235
+    """
+    g %= p
+    h %= p
+    found = factorization(p - 1 if order is None else order)
+    # Strip the factors of order that the order of g lacks.
+    n = found.n
+    pairs = []
+    for q, e in found:
+        while e > 0 and pow(g, n / q, p) == 1:
+            n /= q
+            e -= 1
+        if e > 0:
+            pairs.append((q, e))
+    residues = []
+    moduli = []
+    for q, e in pairs:
+        cofactor = n / q**e
+        residues.append(_prime_power_log(pow(g, cofactor, p),
+                                         pow(h, cofactor, p), q, e, p))
+        moduli.append(q**e)
+    x = chinese_remainder(residues, moduli)
+    if pow(g, x, p) != h:
+        raise ValueError("%d is not a power of %d modulo %d." % (h, g, p))
+    return x
+
+def _bsgs_log(g, h, q, p):
+    """The logarithm of h to the base g, of prime order q modulo p, by
+    baby-step giant-step."""
+    m = integer_sqrt(q - 1) + 1
+    baby_steps = {}
+    y = 1
+    for j in xrange(m):
+        baby_steps.setdefault(y, j)
+        y = y * g % p
+    giant_step = inversemod(y, p)
+    for i in xrange(m):
+        if h in baby_steps:
+            return i * m + baby_steps[h]
+        h = h * giant_step % p
+    raise ValueError("No logarithm in the subgroup of order %d." % q)
+
+def _kangaroo_log(g, h, q, p):
+    """The logarithm of h to the base g, of prime order q modulo p, by
+    Pollard's kangaroo method: a tame kangaroo leaps from g**q = 1 and
+    sets a trap where it lands, and a wild one leaps from h, with leaps
+    that depend only on the current number, until it falls into the trap
+    or passes it.  Each failure retries from h * g**r for a random r."""
+    if pow(h, q, p) != 1:
+        raise ValueError("No logarithm in the subgroup of order %d." % q)
+    root = integer_sqrt(q)
+    k = 1
+    while ((1 << k) - 1) / k < root / 2:
+        k += 1
+    leaps = [pow(g, 1 << i, p) for i in xrange(k)]
+    while True:
+        y = 1
+        tame = 0
+        for _ in xrange(2 * root + 1):
+            i = y % k
+            y = y * leaps[i] % p
+            tame += 1 << i
+        trap = y
+        r = randrange(q)
+        y = h * pow(g, r, p) % p
+        wild = 0
+        while wild <= q + tame:
+            if y == trap:
+                return (q + tame - wild - r) % q
+            i = y % k
+            y = y * leaps[i] % p
+            wild += 1 << i
+
+def _prime_power_log(g, h, q, e, p):
+    """The logarithm of h to the base g, of order q**e modulo p, one base q
+    digit at a time, each found in the subgroup of order q."""
+    gamma = pow(g, q**(e - 1), p)
+    inverse = inversemod(g, p)
+    x = 0
+    for k in xrange(e):
+        digit_power = pow(h * pow(inverse, x, p) % p, q**(e - 1 - k), p)
+        if q <= BSGS_TABLE_LIMIT**2:
+            digit = _bsgs_log(gamma, digit_power, q, p)
+        else:
+            digit = _kangaroo_log(gamma, digit_power, q, p)
+        x += digit * q**k
+    return x
+
+##################################################
+## Enumerating Primes
+##################################################
+
+# Number of odd numbers sieved at once by iter_primes.  One byte per odd
+# number, so a segment occupies 256 KiB and stays resident in L2 cache.
+SIEVE_SEGMENT_SIZE = 1 << 18
+
+def integer_sqrt(n):
+    """integer_sqrt(n) -> The largest integer whose square does not exceed
+    n."""
+    if n < 0:
+        raise ValueError("Square root of a negative number.")
+    if n == 0:
+        return 0
+    x = 1 << ((n.bit_length() + 1) / 2)
+    while True:
+        y = (x + n / x) / 2
+        if y >= x:
+            return x
+        x = y
+
+def iter_primes(n=None, start=2):
+    """
+    Generates the primes p with start <= p <= n in
+    increasing order, using a segmented Sieve of
+    Eratosthenes over the odd numbers.  Only one
+    segment of SIEVE_SEGMENT_SIZE flags and the primes
+    up to sqrt(n) are held in memory at a time.
+    Input:
+        n -- an integer, or None to generate forever
+        start -- (optional) an integer
+    Output:
+        generator -- the primes in [start, n]
+    Examples:
+    >>> list(iter_primes(30, 10))
+    [11, 13, 17, 19, 23, 29]
+    """
+    if start <= 2 and (n is None or n >= 2):
+        yield 2
+    lo = max(start, 3) | 1
+    span = 2 * SIEVE_SEGMENT_SIZE
+    base = []
+    base_bound = 1
+    while n is None or lo <= n:
+        hi = lo + span
+        if n is not None:
+            hi = min(hi, n + 1)
+        root = integer_sqrt(hi - 1)
+        if root > base_bound:
+            base_bound = max(root, 2 * base_bound)
+            base = _odd_primes(base_bound)
+        size = (hi - lo + 1) / 2
+        segment = bytearray([1]) * size
+        for p in base:
+            if p > root:
+                break
+            multiple = p * p
+            if multiple < lo:
+                multiple = (lo + p - 1) / p * p
+                if multiple % 2 == 0:
+                    multiple += p
+            i = (multiple - lo) / 2
+            if i < size:
+                segment[i::p] = bytearray((size - 1 - i) / p + 1)
+        for i in compress(xrange(size), segment):
+            yield lo + 2 * i
+        lo = hi
+
+# Largest bound to which a prime table grows by default.  Requests beyond it
+# are served from the table and then from a fresh segmented sieve.
+PRIME_TABLE_LIMIT = 1 << 27
+
+# Where save_prime_table and load_prime_table keep the shared prime table.
+PRIME_TABLE_PATH = os.path.join(os.path.expanduser("~"), ".cache",
+                                "numbertheory", "primes.bin")
+
+class PrimeTable(object):
+    """The primes up to some bound, held in an array('l') that grows on
+    demand.  The module keeps one shared instance, so repeated factorizations
+    sieve each prime only once per process (or never, if the table is loaded
+    from disk)."""
+
+    def __init__(self, limit=PRIME_TABLE_LIMIT):
+        self.bound = 1
+        self.limit = limit
+        self.primes = array('l')
+
+    def __len__(self):
+        return len(self.primes)
+
+    def extend(self, bound):
+        """Make sure that every prime up to bound is in the table.  The bound
+        at least doubles on each growth, so extending in small steps is
+        cheap."""
+        bound = min(bound, self.limit)
+        if bound <= self.bound:
+            return
+        bound = min(max(bound, 2 * self.bound), self.limit)
+        self.primes.extend(iter_primes(bound, self.bound + 1))
+        self.bound = bound
+
+    def up_to(self, bound):
+        """Generate the primes up to bound in increasing order, growing the
+        table as needed."""
+        self.extend(bound)
+        for p in islice(self.primes, bisect_right(self.primes, bound)):
+            yield p
+        if bound > self.bound:
+            for p in iter_primes(bound, self.bound + 1):
+                yield p
+
+    def load(self, path):
+        """Replace the table with one written by save."""
+        with open(path, "rb") as table_file:
+            header = array('l')
+            header.fromfile(table_file, 1)
+            size = os.fstat(table_file.fileno()).st_size
+            count = size / header.itemsize - 1
+            primes = array('l')
+            primes.fromfile(table_file, count)
+        self.bound = header[0]
+        self.primes = primes
+
+    def save(self, path):
+        """Write the table to path: its bound, then the primes, all as
+        native machine words."""
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, "wb") as table_file:
+            array('l', [self.bound]).tofile(table_file)
+            self.primes.tofile(table_file)
+
+_prime_table = PrimeTable()
+
+def load_prime_table(path=PRIME_TABLE_PATH):
+    """load_prime_table(path) -> Replace the shared prime table with the one
+    saved at path, returning False if there is no such file."""
+    if not os.path.exists(path):
+        return False
+    _prime_table.load(path)
+    return True
+
+def prime_array(n):
+    """prime_array(n) -> The primes up to n as a compact array of machine
+    words (typecode 'l', 64 bits on LP64 platforms), which read back as
+    ints rather than longs."""
+    return array('l', iter_primes(n))
+
+def save_prime_table(path=PRIME_TABLE_PATH, bound=None):
+    """save_prime_table(path, bound) -> Write the shared prime table to path,
+    first growing it to bound if one is given."""
+    if bound is not None:
+        _prime_table.extend(bound)
+    _prime_table.save(path)
+
+def _odd_primes(n):
+    """The odd primes up to n, by an unsegmented sieve over the odd numbers.
+    Only used for the base primes of iter_primes, so n is small."""
+    size = (n + 1) / 2
+    if size < 2:
+        return []
+    flags = bytearray([1]) * size
+    flags[0] = 0
+    for i in xrange(1, (integer_sqrt(n) + 1) / 2):
+        if flags[i]:
+            p = 2 * i + 1
+            first = p * p / 2
+            flags[first::p] = bytearray((size - 1 - first) / p + 1)
+    return [2 * i + 1 for i in compress(xrange(size), flags)]
+
+##################################################
+## Factoring Ranges
+##################################################
+
+# Shared smallest-prime-factor table, grown by smallest_prime_factors.
+_spf_table = array('i')
+
+def divisor_count_range(lo, hi):
+    """divisor_count_range(lo, hi) -> An array of the number of divisors of
+    each integer in [lo, hi), for lo >= 1."""
+    spf, rest, exponent = _spf_decomposition(hi)
+    count = array('l', [0, 1])
+    count.extend(array('l', [0]) * (hi - 2))
+    for k in xrange(2, hi):
+        count[k] = count[rest[k]] * (exponent[k] + 1)
+    return count[lo:hi]
+
+def divisor_sum_range(lo, hi):
+    """divisor_sum_range(lo, hi) -> An array of the sum of the divisors of
+    each integer in [lo, hi), for lo >= 1."""
+    spf, rest, exponent = _spf_decomposition(hi)
+    sigma = array('l', [0, 1])
+    sigma.extend(array('l', [0]) * (hi - 2))
+    for k in xrange(2, hi):
+        p = spf[k]
+        r = rest[k]
+        sigma[k] = sigma[r] * ((k / r * p - 1) / (p - 1))
+    return sigma[lo:hi]
+
+def factor_range(lo, hi):
+    """
+    Generates the factorization of every integer in
+    [lo, hi), each as a sorted list of tuples (p, e),
+    using a table of smallest prime factors.  Each
+    factorization costs O(log n) divisions.
+    Input:
+        lo -- a positive integer
+        hi -- an integer
+    Output:
+        generator -- factorizations of lo, lo+1, ..., hi-1
+    Examples:
+    >>> list(factor_range(10, 13))
+    [[(2, 1), (5, 1)], [(11, 1)], [(2, 2), (3, 1)]]
+    """
+    spf = smallest_prime_factors(hi - 1)
+    for k in xrange(max(lo, 1), hi):
+        yield _spf_factorization(k, spf)
+
+def smallest_prime_factors(n):
+    """
+    Returns the shared table of smallest prime factors,
+    grown if needed so that it covers every integer up
+    to n.  Entry k of the table is the least prime
+    dividing k, for k >= 2.  Once the table covers n,
+    factor, prime_factors and prime_factorization use it
+    for every integer up to n.
+    Input:
+        n -- an integer
+    Output:
+        array -- the table, with at least n+1 entries
+    Examples:
+    >>> list(smallest_prime_factors(10))[:11]
+    [0, 1, 2, 3, 2, 5, 2, 7, 2, 3, 2]
+    """
+    global _spf_table
+    if n < len(_spf_table):
+        return _spf_table
+    n = max(n, 2 * len(_spf_table))
+    # Signed typecodes, so that entries read back as ints, not longs.
+    typecode = 'i' if n < 1 << 31 else 'l'
+    spf = array(typecode, xrange(n + 1))
+    # Crossing off with the largest primes first leaves the smallest prime
+    # factor in each entry, and every pass is a single slice assignment.
+    for p in reversed(list(_prime_table.up_to(integer_sqrt(n)))):
+        spf[p * p::p] = array(typecode, [p]) * ((n - p * p) / p + 1)
+    _spf_table = spf
+    return spf
+
+def totient_range(lo, hi):
+    """
+    Returns Euler's phi function of every integer in
+    [lo, hi), computed together from a table of
+    smallest prime factors.
+    Input:
+        lo -- a positive integer
+        hi -- an integer
+    Output:
+        array -- phi(lo), phi(lo+1), ..., phi(hi-1)
+    Examples:
+    >>> list(totient_range(1, 11))
+    [1, 1, 2, 2, 4, 2, 6, 4, 6, 4]
+    """
+    spf, rest, exponent = _spf_decomposition(hi)
+    phi = array('l', [0, 1])
+    phi.extend(array('l', [0]) * (hi - 2))
+    for k in xrange(2, hi):
+        r = rest[k]
+        prime_power = k / r
+        phi[k] = phi[r] * (prime_power - prime_power / spf[k])
+    return phi[lo:hi]
+
+def _spf_decomposition(hi):
+    """Split every 1 < k < hi as p**e * rest with p the smallest prime factor
+    of k.  Returns the smallest prime factor table and arrays of rest and e,
+    from which a multiplicative function follows by f(k) = f(rest)*f(p**e)."""
+    spf = smallest_prime_factors(max(hi - 1, 1))
+    rest = array(spf.typecode, [0]) * max(hi, 2)
+    exponent = array('B', [0]) * max(hi, 2)
+    rest[1] = 1
+    for k in xrange(2, hi):
+        p = spf[k]
+        m = k / p
+        if spf[m] == p:
+            rest[k] = rest[m]
+            exponent[k] = exponent[m] + 1
+        else:
+            rest[k] = m
+            exponent[k] = 1
+    return spf, rest, exponent
+
+def _spf_factorization(n, spf):
+    """The factorization of n as a sorted list of (p, e) tuples, read from a
+    table of smallest prime factors that covers n."""
+    found = []
+    while n > 1:
+        p = spf[n]
+        power = 0
+        while n % p == 0:
+            power += 1
+            n /= p
+        found.append((p, power))
+    return found
+
+##################################################
+## Elliptic Curve Factorization
+##################################################
+
+# Curves are Montgomery curves B*y**2 = x**3 + A*x**2 + x, described by
+# (A+2)/4 and handled in projective x-only coordinates (X:Z), so that no
+# point operation needs a modular inversion.
+
+# Stage 1 bound and number of curves for each size, in digits, of factor
+# sought by ecm_factor.  The bounds are GMP-ECM's recommendations; the curve
+# counts are raised to allow for the smaller stage 2 used here.
+ECM_PARAMETERS = [(15, 2000, 30), (20, 11000, 100), (25, 50000, 300),
+                  (30, 250000, 700), (35, 1000000, 1800),
+                  (40, 3000000, 5000)]
+
+# Ratio of the default stage 2 bound to the stage 1 bound.
+ECM_STAGE2_RATIO = 100
+
+def ecm(number, B1, B2=None, curves=100):
+    """
+    Use the elliptic curve method to try to find a
+    nontrivial divisor of number.  Each curve comes from
+    Suyama's parametrization with a random parameter.
+    Stage 1 multiplies its point by every prime power up
+    to B1; stage 2 looks for a single further prime
+    between B1 and B2 by baby-step giant-step.
+    Input:
+        number -- an odd composite integer, not a prime
+                  power
+        B1 -- a positive integer, the stage 1 bound
+        B2 -- (optional) the stage 2 bound, by default
+              ECM_STAGE2_RATIO*B1
+        curves -- (optional) the number of curves to try
+    Output:
+        int -- a nontrivial divisor of number, or number
+               if every curve fails
+    Examples:
+    >>> ecm(1000000007 * 998244353, 1000)
+    998244353L     #rand
+    """
+    if B2 is None:
+        B2 = ECM_STAGE2_RATIO * B1
+    for _ in xrange(curves):
+        g = ecm_curve(number, randrange(6, number - 1), B1, B2)
+        if 1 < g < number:
+            return g
+    return number
+
+def ecm_curve(number, sigma, B1, B2):
+    """
+    Run both stages of the elliptic curve method on the
+    Suyama curve with parameter sigma.
+    Input:
+        number -- an odd composite integer
+        sigma -- an integer between 6 and number-1
+        B1 -- the stage 1 bound
+        B2 -- the stage 2 bound (no stage 2 if B2 <= B1)
+    Output:
+        int -- a divisor of number: 1 if the curve
+               failed, possibly number itself
+    """
+    try:
+        X, Z, a24 = suyama_curve(sigma, number)
+    except ZeroDivisionError, failure:
+        return gcd(failure.args[0], number)
+    for p in _prime_table.up_to(B1):
+        q = p
+        while q * p <= B1:
+            q *= p
+        X, Z = montgomery_multiply(q, X, Z, a24, number)
+    g = gcd(Z, number)
+    if g != 1 or B2 <= B1:
+        return g
+    return gcd(_ecm_stage2(X, Z, a24, number, B1, B2), number)
+
+def ecm_factor(number, max_digits=40):
+    """ecm_factor(number, max_digits) - Use the elliptic curve method with
+    the parameters of ECM_PARAMETERS, for ever larger factors up to
+    max_digits digits, to find a nontrivial divisor of the odd composite
+    number.  Returns number if none is found."""
+    root = integer_sqrt(number)
+    if root * root == number:
+        return root
+    for digits, B1, curves in ECM_PARAMETERS:
+        if digits > max_digits:
+            break
+        g = ecm(number, B1, curves=curves)
+        if g != number:
+            return g
+        if 10 ** digits > root:
+            break
+    return number
+
+def montgomery_multiply(k, X, Z, a24, number):
+    """
+    Returns the multiple k*P of the point P = (X:Z) on the
+    Montgomery curve with (A+2)/4 = a24 over Z/nZ, by the
+    Montgomery ladder.
+    Input:
+        k -- a positive integer
+        X, Z -- projective x-coordinate of P
+        a24 -- the curve constant (A+2)/4 modulo number
+        number -- the modulus
+    Output:
+        tuple -- the pair (X', Z') for k*P
+    """
+    if k == 1:
+        return X, Z
+    s = (X + Z) * (X + Z) % number
+    d = (X - Z) * (X - Z) % number
+    t = s - d
+    X1, Z1 = X, Z
+    X2, Z2 = s * d % number, t * (d + a24 * t) % number
+    for bit in bin(k)[3:]:
+        u = (X1 - Z1) * (X2 + Z2)
+        v = (X1 + Z1) * (X2 - Z2)
+        sum_X = Z * (u + v) * (u + v) % number
+        sum_Z = X * (u - v) * (u - v) % number
+        if bit == "1":
+            s = (X2 + Z2) * (X2 + Z2) % number
+            d = (X2 - Z2) * (X2 - Z2) % number
+            t = s - d
+            X1, Z1 = sum_X, sum_Z
+            X2, Z2 = s * d % number, t * (d + a24 * t) % number
+        else:
+            s = (X1 + Z1) * (X1 + Z1) % number
+            d = (X1 - Z1) * (X1 - Z1) % number
+            t = s - d
+            X2, Z2 = sum_X, sum_Z
+            X1, Z1 = s * d % number, t * (d + a24 * t) % number
+    return X1, Z1
+
+def suyama_curve(sigma, number):
+    """
+    Returns a Montgomery curve and point on it from
+    Suyama's parametrization, which gives the curve a
+    group order divisible by 12.  Raises
+    ZeroDivisionError, as inversemod does, if the curve
+    constant cannot be computed modulo number.
+    Input:
+        sigma -- an integer other than 0, 1, 3, 5
+        number -- the modulus
+    Output:
+        tuple -- (X, Z, a24): the starting point (X:Z) and
+                 the curve constant (A+2)/4
+    """
+    u = (sigma * sigma - 5) % number
+    v = 4 * sigma % number
+    X = pow(u, 3, number)
+    Z = pow(v, 3, number)
+    numerator = pow(v - u, 3, number) * (3 * u + v) % number
+    a24 = numerator * inversemod(16 * X * v, number) % number
+    return X, Z, a24
+
+def _ecm_stage2(X, Z, a24, number, B1, B2):
+    """Baby-step giant-step stage 2.  Each prime p in (B1, B2] is written as
+    k*D + d with |d| < D/2, and the product of X(kDQ) - x(dQ)*Z(kDQ) over
+    all of them, which vanishes modulo a factor whenever some pQ is the
+    identity there, is returned."""
+    D = 2310 if B2 - B1 > 10**6 else 210
+    montgomery_double = lambda X, Z: montgomery_multiply(2, X, Z, a24, number)
+    def montgomery_add(P, Q, difference):
+        u = (P[0] - P[1]) * (Q[0] + Q[1])
+        v = (P[0] + P[1]) * (Q[0] - Q[1])
+        return (difference[1] * (u + v) * (u + v) % number,
+                difference[0] * (u - v) * (u - v) % number)
+    # Baby steps: d*Q for odd d < D/2 coprime to D.
+    Q = (X, Z)
+    twice = montgomery_double(X, Z)
+    baby = {1: Q}
+    previous, current = Q, montgomery_add(twice, Q, Q)
+    for d in xrange(3, D / 2, 2):
+        if gcd(d, D) == 1:
+            baby[d] = current
+        previous, current = current, montgomery_add(current, twice, previous)
+    # Normalize the baby steps to Z = 1 with one inversion, saving a
+    # multiplication for every prime below.  A Z that cannot be inverted
+    # already shares a factor with number.
+    differences = sorted(baby)
+    try:
+        inverses = batch_inverse([baby[d][1] for d in differences], number)
+    except ZeroDivisionError, failure:
+        return failure.args[0]
+    baby = dict((d, baby[d][0] * inverse % number)
+                for d, inverse in zip(differences, inverses))
+    # Giant steps: k*D*Q for consecutive k.
+    step = montgomery_multiply(D, X, Z, a24, number)
+    k = max(1, (B1 + D / 2) / D)
+    giant = montgomery_multiply(k, step[0], step[1], a24, number)
+    following = montgomery_multiply(k + 1, step[0], step[1], a24, number)
+    product = 1
+    for p in iter_primes(B2, B1 + 1):
+        while p > k * D + D / 2:
+            giant, following = following, montgomery_add(following, step,
+                                                         giant)
+            k += 1
+        baby_x = baby.get(abs(p - k * D))
+        if baby_x is not None:
+            product = product * (giant[0] - baby_x * giant[1]) % number
+    return product
+
+##################################################
+## Parallel Factorization
+##################################################
+
+# Steps in each of the Pollard rho walks that open a parallel search.
+PARALLEL_RHO_STEPS = 1 << 20
+
+def parallel_find_factor(number, workers=0, timeout=None):
+    """
+    Search for a nontrivial divisor of the odd composite
+    number with independent random trials on a pool of
+    processes: first one Pollard rho walk per process,
+    then elliptic curves with the parameters of
+    ECM_PARAMETERS.  As soon as any trial succeeds, the
+    pool is terminated, cancelling the rest.
+    Input:
+        number -- an odd composite integer
+        workers -- (optional) the number of processes, by
+                   default one per CPU
+        timeout -- (optional) a limit in seconds
+    Output:
+        int -- a nontrivial divisor of number, or number
+               if every trial failed or time ran out
+    """
+    workers = workers or cpu_count()
+    deadline = None if timeout is None else time.time() + timeout
+    # Reseed each process, or the forked walks would all be identical.
+    pool = Pool(workers, initializer=random.seed)
+    try:
+        results = pool.imap_unordered(_run_factor_trial,
+                                      _factor_trials(number, workers))
+        while True:
+            if deadline is None:
+                g = results.next()
+            else:
+                g = results.next(max(deadline - time.time(), 0))
+            if 1 < g < number:
+                return g
+    except (StopIteration, TimeoutError):
+        return number
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _factor_trials(number, workers):
+    """The schedule of trials for parallel_find_factor, cheapest first."""
+    trials = [("rho", number, PARALLEL_RHO_STEPS)] * workers
+    for _, B1, curves in ECM_PARAMETERS:
+        B2 = ECM_STAGE2_RATIO * B1
+        trials.extend(("ecm", number, randrange(6, number - 1), B1, B2)
+                      for _ in xrange(curves))
+    return trials
+
+def _parallel_factor(n, workers, timeout):
+    """Factor n > 1 for factor, splitting composites in parallel."""
+    deadline = None if timeout is None else time.time() + timeout
+    found = {}
+    composites = []
+    for p, e in _prime_factorization(n, _prime_table.up_to(1000)):
+        if p < 1000 ** 2 or is_prime(p):
+            found[p] = found.get(p, 0) + e
+        else:
+            composites.append(p)
+    while composites:
+        c = composites.pop()
+        if is_prime(c):
+            found[c] = found.get(c, 0) + 1
+            continue
+        root = integer_sqrt(c)
+        if root * root == c:
+            composites.extend([root, root])
+            continue
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.time()
+        g = c
+        if remaining is None or remaining > 0:
+            g = parallel_find_factor(c, workers, remaining)
+        if g == c:
+            if deadline is not None and time.time() >= deadline:
+                raise RuntimeError("Timed out factoring %d." % c)
+            raise RuntimeError("Every trial failed to factor %d." % c)
+        composites.extend([g, c / g])
+    return sorted(found.items())
+
+def _run_factor_trial(trial):
+    """Run one trial from _factor_trials in a worker process."""
+    if trial[0] == "rho":
+        return pollard_rho(trial[1], trial[2])
+    return ecm_curve(*trial[1:])
+
+##################################################
+## Batch Computations
+##################################################
+
+# Number of items the batch functions hand to a worker at a time.
+BATCH_CHUNK_SIZE = 1024
+
+# Bound to which the shared prime table is grown before a worker pool is
+# started, so that the forked workers share it instead of each sieving.
+BATCH_PRIME_BOUND = 1 << 20
+
+def divisors_many(numbers, chunk_size=BATCH_CHUNK_SIZE, workers=None):
+    """divisors_many(numbers, chunk_size, workers) -> Generate divisors(n)
+    for each n in the iterable numbers, in order.  See map_batched."""
+    return map_batched(divisors, numbers, chunk_size, workers)
+
+def factor_many(numbers, chunk_size=BATCH_CHUNK_SIZE, workers=None):
+    """factor_many(numbers, chunk_size, workers) -> Generate factor(n) for
+    each n in the iterable numbers, in order.  See map_batched."""
+    return map_batched(factor, numbers, chunk_size, workers)
+
+def is_prime_many(numbers, chunk_size=BATCH_CHUNK_SIZE, workers=None):
+    """is_prime_many(numbers, chunk_size, workers) -> Generate is_prime(n)
+    for each n in the iterable numbers, in order.  See map_batched."""
+    return map_batched(is_prime, numbers, chunk_size, workers)
+
+def map_batched(function, numbers, chunk_size=BATCH_CHUNK_SIZE,
+                workers=None, args=()):
+    """
+    Generate function(n, *args) for each n in the
+    iterable numbers, in order, handling chunk_size items
+    at a time.  If workers is given, the chunks are spread
+    over a pool of that many processes (one per CPU if
+    workers is 0).  The shared prime table is built
+    before the pool starts, so every worker inherits it,
+    and no more than two chunks per worker are in
+    flight, so numbers may be an arbitrarily long stream.
+    Input:
+        function -- a module-level function
+        numbers -- an iterable of integers
+        chunk_size -- (optional) a positive integer
+        workers -- (optional) a number of processes
+        args -- (optional) a tuple of further arguments
+    Output:
+        generator -- the results, in the order of numbers
+    Examples:
+    >>> list(map_batched(totient, [10, 11, 12], workers=2))
+    [4, 10, 4]
+    """
+    chunks = chunked(numbers, chunk_size)
+    if workers is None:
+        for chunk in chunks:
+            for result in _apply_to_chunk(function, chunk, args):
+                yield result
+        return
+    workers = workers or cpu_count()
+    _prime_table.extend(BATCH_PRIME_BOUND)
+    pool = Pool(workers)
+    try:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_apply_to_chunk,
+                                            (function, chunk, args)))
+            if len(pending) >= 2 * workers:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+def chunked(iterable, size):
+    """chunked(iterable, size) -> Generate consecutive lists of size items
+    (the last may be shorter) from iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+##################################################
+## Batch GCD
+##################################################
+
+# Bits of precision beyond twice the size of each node that the scaled
+# remainder tree of batch_gcd keeps.  Truncation costs at most a unit in the
+# last place per level, so this leaves room for trees of any depth.
+SCALED_REMAINDER_GUARD = 64
+
+# Size in bits of reciprocal above which _reciprocal uses Newton's method
+# rather than long division, which takes time quadratic in the size of the
+# numbers.
+NEWTON_DIVISION_THRESHOLD = 1 << 14
+
+def batch_gcd(numbers):
+    """
+    Returns, for each of the positive integers, its
+    greatest common divisor with the product of all the
+    others, by Bernstein's product tree and scaled
+    remainder tree.  For P the product of all the
+    numbers, and each node N of the product tree, the
+    fraction P/N**2 mod 1 is carried down the tree to
+    fixed precision, each child taking that of its parent
+    times the square of its sibling: one multiplication
+    per node rather than a long division.  At the leaves
+    the fraction times n**2 is P mod n**2, and
+    gcd(n, (P mod n**2)/n) is the divisor n shares with
+    the rest.  This finds the primes shared by RSA moduli
+    in time close to linear in the total size of the
+    moduli, where comparing every pair takes quadratic
+    time.
+    Input:
+        numbers -- a sequence of positive integers
+    Output:
+        list -- for each number n, a divisor of n: 1 if n
+                is coprime to all the others, n itself if
+                every prime of n divides some other
+    Examples:
+    >>> batch_gcd([6, 35, 11, 77])
+    [1, 7, 11, 77]
+    """
+    numbers = list(numbers)
+    if len(numbers) < 2:
+        return [1] * len(numbers)
+    tree = product_tree(numbers)
+    scaled = [_scaled_root(tree[-1][0])]
+    for level in reversed(tree[:-1]):
+        scaled = list(_scaled_remainders(scaled, level))
+    return [_shared_divisor(fraction, n)
+            for fraction, n in zip(scaled, numbers)]
+
+def batch_gcd_on_disk(numbers, directory):
+    """
+    Generate the divisors batch_gcd would return, for
+    numbers too many to hold their product and remainder
+    trees in memory: each level of both trees is written
+    to a file in directory as it is computed and read
+    back one number at a time, so that only a few nodes
+    of one level are in memory at once.  Each file is
+    deleted as soon as the next level down is written.
+    Input:
+        numbers -- an iterable of positive integers,
+                   which is read only once
+        directory -- the name of an existing directory
+    Output:
+        generator -- the divisors, in the order of the
+                     numbers
+    """
+    path = lambda tree, depth: os.path.join(directory,
+                                            "%s-%02d" % (tree, depth))
+    depth = 0
+    try:
+        count = _write_numbers(path("product", 0), numbers)
+        while count > 1:
+            count = _write_numbers(path("product", depth + 1),
+                                   _pair_products(_read_numbers(
+                                       path("product", depth))))
+            depth += 1
+        if depth == 0:
+            for _ in xrange(count):
+                yield 1
+            return
+        root, = _read_numbers(path("product", depth))
+        _write_numbers(path("remainder", depth), [_scaled_root(root)])
+        os.remove(path("product", depth))
+        del root
+        for depth in xrange(depth - 1, -1, -1):
+            _write_numbers(path("remainder", depth),
+                           _scaled_remainders(
+                               _read_numbers(path("remainder", depth + 1)),
+                               _read_numbers(path("product", depth))))
+            os.remove(path("remainder", depth + 1))
+            if depth > 0:
+                os.remove(path("product", depth))
+        for fraction, n in izip(_read_numbers(path("remainder", 0)),
+                                _read_numbers(path("product", 0))):
+            yield _shared_divisor(fraction, n)
+    finally:
+        for tree in ["product", "remainder"]:
+            for level in xrange(depth + 2):
+                if os.path.exists(path(tree, level)):
+                    os.remove(path(tree, level))
+
+def product_tree(numbers):
+    """
+    Returns the levels of the product tree of the
+    integers: the first level is the numbers themselves,
+    each later level holds the products of adjacent pairs
+    of the level before (an odd one out is carried up
+    alone), and the last holds the product of them all.
+    Input:
+        numbers -- a nonempty sequence of integers
+    Output:
+        list -- a list of lists of integers
+    Examples:
+    >>> product_tree([2, 3, 5, 7, 11])
+    [[2, 3, 5, 7, 11], [6, 35, 11], [210, 11], [2310]]
+    """
+    tree = [list(numbers)]
+    while len(tree[-1]) > 1:
+        level = tree[-1]
+        tree.append([reduce(mul, level[i:i + 2])
+                     for i in xrange(0, len(level), 2)])
+    return tree
+
+def _pair_products(numbers):
+    """The products of adjacent pairs of the numbers, the last alone if
+    there is an odd one out: the next level up of a product tree."""
+    numbers = iter(numbers)
+    for a in numbers:
+        b = next(numbers, None)
+        yield a if b is None else a * b
+
+def _read_numbers(path):
+    """The values _write_numbers wrote to the file at path."""
+    with open(path, "rb") as stream:
+        while True:
+            try:
+                yield marshal.load(stream)
+            except EOFError:
+                return
+
+def _reciprocal(m, k):
+    """An integer within a few units of 2**k / m, for 2**k > m, by one
+    Newton step from a reciprocal of half the precision, computed from the
+    leading bits of m alone."""
+    n = m.bit_length()
+    precision = k - n
+    if precision <= NEWTON_DIVISION_THRESHOLD:
+        return (1 << k) // m
+    half = precision / 2 + 16
+    shift = max(0, n - half - 32)
+    x = _reciprocal(m >> shift, n - shift + half) << (precision - half)
+    return x + ((x * ((1 << k) - m * x)) >> k)
+
+def _scaled_remainders(parents, nodes):
+    """The fractions (T, k), standing for T / 2**k, of the children among
+    the nodes of each of the parent fractions: the next level down of a
+    scaled remainder tree.  A child alone takes its parent's fraction."""
+    nodes = iter(nodes)
+    for T, k in parents:
+        left = next(nodes)
+        right = next(nodes, None)
+        if right is None:
+            yield T, k
+            continue
+        for node, sibling in [(left, right), (right, left)]:
+            bits = 2 * node.bit_length() + SCALED_REMAINDER_GUARD
+            square = sibling * sibling
+            yield (T * square >> (k - bits)) & ((1 << bits) - 1), bits
+
+def _scaled_root(root):
+    """The fraction (T, k) for the root of a scaled remainder tree, for
+    which P/N**2 = 1/P."""
+    bits = 2 * root.bit_length() + SCALED_REMAINDER_GUARD
+    return _reciprocal(root, bits), bits
+
+def _shared_divisor(fraction, n):
+    """The divisor of n shared with the rest of a batch_gcd, from the
+    fraction (T, k), T/2**k, of its leaf of the scaled remainder tree."""
+    T, k = fraction
+    square = n * n
+    remainder = ((T * square + (1 << (k - 1))) >> k) % square
+    # The remainder is a long even when n is an int; keep divisors that fit
+    # in a machine word as ints.
+    return int(gcd(remainder / n, n))
+
+def _write_numbers(path, numbers):
+    """Write the integers, or tuples of integers, to the file at path one
+    after another, returning how many there were."""
+    count = 0
+    with open(path, "wb") as stream:
+        for number in numbers:
+            marshal.dump(number, stream)
+            count += 1
+    return count
+
+##################################################
+## Residue Number Systems
+##################################################
+
+# An integer in a residue number system is held as its residues modulo a
+# basis of primes below 2**RNS_PRIME_BITS, so that the product of two
+# residues fits in a machine word and every channel computes on plain ints,
+# however large the integer is.  The channels are independent of each
+# other, so they may be split over processes.
+RNS_PRIME_BITS = 31
+
+class RNSBasis(object):
+    """
+    The word-sized primes of a residue number system,
+    stored in an array, with the CRTPlan that converts
+    residues back into integers.  Calling a basis on an
+    integer gives its RNSInteger.
+    Examples:
+    >>> basis = RNSBasis([5, 7, 11])
+    >>> x = basis(12)
+    >>> x.residues
+    array('l', [2, 5, 1])
+    >>> int(x * x - 150)
+    -6
+    """
+
+    def __init__(self, primes):
+        self.moduli = array('l', primes)
+        self.plan = CRTPlan(primes)
+        self.modulus = self.plan.modulus
+
+    def __call__(self, number):
+        return RNSInteger(number, self)
+
+    def __eq__(self, other):
+        return isinstance(other, RNSBasis) and self.moduli == other.moduli
+
+    def __hash__(self):
+        return hash(tuple(self.moduli))
+
+    def __len__(self):
+        return len(self.moduli)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __reduce__(self):
+        return _load_rns_basis, (self.moduli.tolist(),)
+
+    def residues(self, number):
+        """The residues of number as an array, one per prime."""
+        return array('l', [number % m for m in self.moduli])
+
+    def value(self, residues):
+        """The integer of least absolute value with the given residues."""
+        x = self.plan.reconstruct(residues)
+        return x - self.modulus if 2 * x > self.modulus else x
+
+class RNSInteger(object):
+    """An integer held as its residues over an RNSBasis.  Addition,
+    subtraction, multiplication, exact division and powers work channel by
+    channel on machine words, and long() reconstructs the integer by the
+    basis's CRTPlan; results are exact as long as every value stays below
+    half the product of the basis in absolute value.  Plain integers are
+    converted when combined with an RNSInteger.  RNSIntegers pickle with
+    their residues and the primes of their basis, and unpickle onto the
+    basis rns_basis made, if it has the same primes."""
+
+    __slots__ = ("basis", "residues")
+
+    __hash__ = None
+
+    def __init__(self, number, basis):
+        self.basis = basis
+        self.residues = basis.residues(number)
+
+    @classmethod
+    def from_residues(cls, residues, basis):
+        """The RNSInteger with the given residues, which are not checked."""
+        x = object.__new__(cls)
+        x.basis = basis
+        x.residues = array('l', residues)
+        return x
+
+    def __add__(self, other):
+        return self._channelwise(add, other)
+
+    __radd__ = __add__
+
+    def __div__(self, other):
+        """The exact quotient, by solve_linear in each channel.  If other
+        does not divide self the result is meaningless, and if other shares
+        a prime with the basis ZeroDivisionError is raised."""
+        residues = self._coerce(other)
+        if residues is None:
+            return NotImplemented
+        quotients = array('l')
+        for a, b, m in izip(self.residues, residues, self.basis.moduli):
+            if b == 0:
+                raise ZeroDivisionError("Divisor is 0 modulo %d." % m)
+            quotients.append(solve_linear(b, a, m))
+        return RNSInteger.from_residues(quotients, self.basis)
+
+    __truediv__ = __div__
+
+    def __eq__(self, other):
+        residues = self._coerce(other)
+        if residues is None:
+            return NotImplemented
+        return self.residues == residues
+
+    def __int__(self):
+        return int(self.basis.value(self.residues))
+
+    def __long__(self):
+        return long(self.basis.value(self.residues))
+
+    def __mul__(self, other):
+        return self._channelwise(mul, other)
+
+    __rmul__ = __mul__
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __neg__(self):
+        return RNSInteger.from_residues(
+            imap(mod, imap(neg, self.residues), self.basis.moduli), self.basis)
+
+    def __pow__(self, exponent):
+        assert exponent >= 0, "exponent must be nonnegative."
+        return RNSInteger.from_residues(
+            imap(pow, self.residues, repeat(exponent), self.basis.moduli),
+            self.basis)
+
+    def __reduce__(self):
+        return _load_rns_integer, (self.residues.tolist(), self.basis)
+
+    def __repr__(self):
+        return "RNSInteger(%d)" % long(self)
+
+    def __rsub__(self, other):
+        return self._channelwise(sub, other, reverse=True)
+
+    def __sub__(self, other):
+        return self._channelwise(sub, other)
+
+    def _channelwise(self, operation, other, reverse=False):
+        """operation applied to the residues of self and of other in each
+        channel, reduced by the channel's prime, or NotImplemented if other
+        is not an integer."""
+        residues = self._coerce(other)
+        if residues is None:
+            return NotImplemented
+        if reverse:
+            combined = imap(operation, residues, self.residues)
+        else:
+            combined = imap(operation, self.residues, residues)
+        return RNSInteger.from_residues(imap(mod, combined, self.basis.moduli),
+                                        self.basis)
+
+    def _coerce(self, other):
+        """The residues of other, an RNSInteger over the same basis or a
+        plain integer, or None if it is neither."""
+        if isinstance(other, RNSInteger):
+            assert other.basis is self.basis or other.basis == self.basis, \
+                   "RNS bases differ."
+            return other.residues
+        if isinstance(other, (int, long)):
+            return self.basis.residues(other)
+        return None
+
+def rns_basis(bits):
+    """
+    Returns an RNSBasis of the largest primes below
+    2**RNS_PRIME_BITS, enough of them to hold integers
+    of up to the given number of bits and either sign.
+    Bases are made once per size and then reused, along
+    with their CRTPlans.
+    Input:
+        bits -- a positive integer
+    Output:
+        RNSBasis -- a basis with modulus above 2**(bits+1)
+    Examples:
+    >>> len(rns_basis(1024))
+    35
+    >>> rns_basis(1024) is rns_basis(1020)
+    True
+    """
+    count = (bits + 1) / (RNS_PRIME_BITS - 1) + 1
+    if count not in _rns_bases:
+        while len(_rns_primes) < count:
+            candidate = _rns_primes[-1] - 2 if _rns_primes \
+                        else (1 << RNS_PRIME_BITS) - 1
+            while not is_prime(candidate):
+                candidate -= 2
+            _rns_primes.append(candidate)
+        _rns_bases[count] = RNSBasis(_rns_primes[:count])
+    return _rns_bases[count]
+
+def rns_product(values, workers=None):
+    """
+    Returns the product of a sequence of RNSIntegers over
+    one basis, as an RNSInteger, multiplying the residues
+    of each channel down the whole sequence.  If workers
+    is given, the channels are spread over that many
+    processes (one per CPU if workers is 0) by
+    map_batched.
+    Input:
+        values -- a nonempty sequence of RNSIntegers
+        workers -- (optional) a number of processes
+    Output:
+        RNSInteger -- the product of the values
+    Examples:
+    >>> basis = rns_basis(64)
+    >>> int(rns_product([basis(n) for n in xrange(1, 21)]))
+    2432902008176640000
+    """
+    values = list(values)
+    basis = values[0].basis
+    channels = izip(basis.moduli, izip(*[x.residues for x in values]))
+    return RNSInteger.from_residues(
+        map_batched(_channel_product, channels, chunk_size=8,
+                    workers=workers), basis)
+
+def _channel_product(channel):
+    """The product of a channel's residues, reduced modulo its prime, from
+    the pair (prime, residues)."""
+    modulus, residues = channel
+    product = 1
+    for residue in residues:
+        product = product * residue % modulus
+    return product
+
+def _load_rns_basis(primes):
+    """The basis with the given primes, the one rns_basis made if it has
+    them, for unpickling."""
+    basis = _rns_bases.get(len(primes))
+    if basis is not None and basis.moduli.tolist() == primes:
+        return basis
+    return RNSBasis(primes)
+
+def _load_rns_integer(residues, basis):
+    """The RNSInteger with the given residues, for unpickling."""
+    return RNSInteger.from_residues(residues, basis)
+
+# Primes below 2**RNS_PRIME_BITS, in descending order, found so far by
+# rns_basis, and the bases made from them, by number of primes.
+_rns_primes = []
+_rns_bases = {}
+
+##################################################
+## Benchmarks
+##################################################
+
+def benchmark_powermod(bit_sizes=(64, 256, 1024, 2048), trials=20):
+    """Print the time per exponentiation, in microseconds, of the modular
+    exponentiation routines against the built-in pow, for random odd moduli
+    and full-size exponents of each size."""
+    print "%6s %10s %10s %10s %10s %10s" % ("bits", "pow", "window",
+                                           "fixed", "2 x pow", "multi")
+    for bits in bit_sizes:
+        modulus = random.getrandbits(bits) | 1 | (1 << (bits - 1))
+        exponents = [random.getrandbits(bits) for _ in xrange(trials)]
+        bases = [random.getrandbits(bits) % modulus for _ in xrange(trials)]
+        multiply = lambda x, y: x * y % modulus
+        fixed = FixedBasePower(2, modulus)
+        timings = [
+            _time_each(lambda e: pow(2, e, modulus), exponents),
+            _time_each(lambda e: sliding_window_power(2, e, multiply),
+                       exponents),
+            _time_each(fixed, exponents),
+            _time_each(lambda e: pow(2, e, modulus) * pow(3, e, modulus) %
+                       modulus, exponents),
+            _time_each(lambda e: multi_powermod([2, 3], [e, e], modulus),
+                       exponents)]
+        print "%6d" % bits + "".join(" %10.1f" % t for t in timings)
+
+def benchmark_jacobi(bit_sizes=(64, 256, 2048), trials=200):
+    """Print the time per symbol, in microseconds, of Euler's criterion
+    a**((p-1)/2) mod p, of jacobi and of jacobi_many, for a random prime p
+    and random residues a of each size."""
+    print "%6s %10s %10s %10s" % ("bits", "euler", "jacobi", "many")
+    for bits in bit_sizes:
+        p = random.getrandbits(bits) | 1 | (1 << (bits - 1))
+        while not is_prime(p):
+            p += 2
+        values = [random.randrange(p) for _ in xrange(trials)]
+        many = _time_each(lambda _: jacobi_many(values, p), [None])
+        timings = [_time_each(lambda a: pow(a, (p - 1) / 2, p), values),
+                   _time_each(lambda a: jacobi(a, p), values),
+                   many / trials]
+        print "%6d" % bits + "".join(" %10.1f" % t for t in timings)
+
+def benchmark_rns(bit_sizes=(256, 1024, 4096, 16384), trials=100):
+    """Print the time per operation, in microseconds, of multiplying two
+    Python longs, of multiplying two RNSIntegers, and of converting an
+    integer into an RNSInteger and back, for random integers of each size
+    over a basis that holds their products."""
+    print "%6s %10s %10s %10s %10s" % ("bits", "long", "rns", "to rns",
+                                      "from rns")
+    for bits in bit_sizes:
+        basis = rns_basis(2 * bits)
+        numbers = [random.getrandbits(bits) for _ in xrange(trials)]
+        values = map(basis, numbers)
+        timings = [_time_each(lambda n: n * numbers[0], numbers),
+                   _time_each(lambda x: x * values[0], values),
+                   _time_each(basis, numbers),
+                   _time_each(long, values)]
+        print "%6d" % bits + "".join(" %10.1f" % t for t in timings)
+
+def _time_each(function, arguments):
+    """Average time in microseconds of function over the arguments."""
+    start = time.time()
+    for argument in arguments:
+        function(argument)
+    return (time.time() - start) / len(arguments) * 1e6
+
+def _apply_to_chunk(function, chunk, args):
+    """The results of function on each item of chunk, as a list."""
+    return [function(n, *args) for n in chunk]
+
 ##################################################
 ## Continued Fractions
 ##################################################
@@ -827,6 +2954,110 @@ def sum_of_two_squares(p):
 ###############################################################################
 
 from py.test import raises
+import pickle
+
+def test_batch_functions():
+    numbers = range(2, 500) + [2**61 - 1, (2**31 - 1) * (2**61 - 1)]
+    expected = [is_prime(n) for n in numbers]
+    assert expected == list(is_prime_many(numbers, chunk_size=7))
+    assert expected == list(is_prime_many(iter(numbers), chunk_size=7,
+                                          workers=2))
+    assert [factor(n) for n in range(2, 50)] == \
+           list(factor_many(xrange(2, 50), workers=2))
+    assert [[1, 2, 4], [1, 5]] == list(divisors_many([4, 5]))
+    assert [] == list(divisors_many([], workers=2))
+
+def test_crt():
+    assert 10 == crt(1, 2, 3, 4)
+    assert 14 == crt(4, 5, 10, 3)
+    assert 10099 == crt(-1, -1, 100, 101)
+    assert 23 == chinese_remainder([2, 3, 2], [3, 5, 7])
+    assert 0 == chinese_remainder([], [])
+    moduli = [2**61 - 1, 2**31 - 1, 1000003, 97]
+    x = 123456789123456789123456789
+    assert x == chinese_remainder([x % m for m in moduli], moduli)
+    raises(ZeroDivisionError, chinese_remainder, [1, 2], [4, 6])
+
+def test_discrete_log():
+    assert 8 == discrete_log(2, 3, 11)
+    assert 0 == discrete_log(5, 1, 11)
+    raises(ValueError, discrete_log, 4, 2, 11)
+    for p in [997, 2**61 - 1, 2**89 - 1]:
+        g = primitive_root(p)
+        for x in [0, 1, 12345 % (p - 1), p - 2]:
+            assert x == discrete_log(g, pow(g, x, p), p)
+            q = factorization(p - 1).primes[-1]
+            assert x % q == discrete_log(pow(g, (p - 1) / q, p),
+                                         pow(g, (p - 1) / q * x, p), p)
+    # g = 4 has order q modulo the safe prime p = 2q + 1.
+    q = 1000000289
+    p = 2 * q + 1
+    for x in [0, 1, 987654321, q - 1]:
+        assert x == discrete_log(4, pow(4, x, p), p)
+        assert x == discrete_log(4, pow(4, x, p), p, order=q)
+        assert x == _kangaroo_log(4, pow(4, x, p), q, p)
+    raises(ValueError, _kangaroo_log, 4, p - 1, q, p)
+    primitive_roots = [primitive_root(p) for p in primes(3000)]
+    assert all(is_primitive_root(g, p) and
+               not any(is_primitive_root(a, p) for a in xrange(2, g))
+               for g, p in izip(primitive_roots[1:], primes(3000)[1:]))
+
+def test_crt_plan():
+    plan = CRTPlan([3, 5, 7])
+    assert 105 == plan.modulus and not plan.checked
+    assert 23 == plan.reconstruct([2, 3, 2])
+    assert 23 == plan.reconstruct([-1, 8, 9])
+    numbers = [0, 1, 23, 104, 105, 10**6]
+    assert [n % 105 for n in numbers] == \
+           plan.reconstruct_many(plan.residues_many(numbers))
+    plan = CRTPlan([12, 18, 8, 1])
+    assert 72 == plan.modulus
+    for n in xrange(72):
+        assert n == plan.reconstruct(plan.residues(n))
+    raises(ValueError, plan.reconstruct, [1, 2, 1, 0])
+    raises(ValueError, plan.reconstruct_many, [[1, 1, 1, 0], [1, 2, 1, 0]])
+    raises(ValueError, CRTPlan([3, 5, 7]).reconstruct, [2, 3])
+    raises(ValueError, CRTPlan([3, 5, 7]).reconstruct_many, [[2, 3, 2, 0]])
+    moduli = primes(10**4)[-50:]
+    plan = CRTPlan(moduli)
+    n = randrange(plan.modulus)
+    assert n == plan.reconstruct(plan.residues(n))
+    assert n == chinese_remainder(plan.residues(n), moduli)
+
+def test_rns():
+    basis = rns_basis(512)
+    assert basis is rns_basis(512)
+    assert basis.modulus > 2**513
+    assert all(m < 2**RNS_PRIME_BITS and is_prime(m) for m in basis.moduli)
+    a = 3**100
+    b = -7**80
+    x = basis(a)
+    y = RNSInteger(b, basis)
+    assert a == long(x) and b == int(y)
+    assert a + b == long(x + y) == long(a + y) == long(x + b)
+    assert a - b == long(x - y) and b - a == long(b - x) == long(-(x - b))
+    assert a * b == long(x * y) == long(b * x)
+    assert a**2 == long(x**2)
+    assert 3**90 == long(x / 3**10)
+    assert x == a and x != b and not x == y
+    raises(ZeroDivisionError, lambda: x / basis.moduli[0])
+    raises(TypeError, hash, x)
+    raises(AttributeError, setattr, x, "value", a)
+    assert RNSInteger.from_residues(x.residues, basis) == x
+    assert not x == None and x != "a" and x in [None, "a", x]
+    raises(TypeError, lambda: x + "a")
+    for protocol in [0, 1, 2]:
+        copy = pickle.loads(pickle.dumps(x * y, protocol))
+        assert copy.basis is basis and copy == x * y and long(copy) == a * b
+        assert copy + x == a * b + a
+    other = pickle.loads(pickle.dumps(RNSBasis([5, 7, 11])))
+    assert other == RNSBasis([5, 7, 11]) and other != basis
+    assert 3 == int(other(-3) * other(-1))
+    assert "RNSInteger(-5)" == repr(basis(-5))
+    values = [basis(randrange(-2**40, 2**40)) for _ in xrange(6)]
+    product = reduce(mul, map(long, values))
+    assert product == long(rns_product(values))
+    assert product == long(rns_product(values, workers=2))
 
 def test_divisors():
     assert [1] == divisors(1)
@@ -843,10 +3074,227 @@ def test_divisors():
     assert [-6, -3, -2, -1, 1, 2, 3, 6] == divisors(-6)
     assert [1, 2, 4, 5, 10, 11, 20, 22, 44, 55, 110, 220] == divisors(220)
     assert [1, 2, 4, 71, 142, 284] == divisors(284)
+    for n in [1, 28, 720720, 2**10 * 3**5 * 5**3, 2**61 - 1]:
+        found = divisors(n)
+        assert found == list(iter_divisors(n))
+        assert found == divisors(factorization(n))
+        assert len(found) == divisor_count(n)
+        assert sum(found) == divisor_sigma(n)
+        assert sum(d**2 for d in found) == divisor_sigma(n, 2)
+        assert len(found) == divisor_sigma(n, 0)
+    smooth = iter_divisors(2**100 * 3**100)
+    assert [1, 2, 3, 4, 6, 8] == list(islice(smooth, 6))
+    assert map(divisor_count, range(1, 100)) == \
+           list(divisor_count_range(1, 100))
+
+def test_factor_range():
+    expected = [prime_factorization(n) for n in xrange(1, 2000)]
+    assert expected == list(factor_range(1, 2000))
+    assert [[(2, 1), (5, 1)], [(11, 1)]] == list(factor_range(10, 12))
+    assert [(2, 2), (5, 3)] == factor(500)
+    assert int is type(factor(500)[0][0])
+    assert [2, 2, 5] == prime_factors(20)
+
+def test_ecm():
+    p = 1000003
+    q = 10**19 + 51
+    # With these parameters stage 1 alone finds p for sigma = 13 only, and
+    # stage 2 is needed for sigma = 7 (the order of the point is 421 times a
+    # 100-smooth number).
+    assert 1 == ecm_curve(p * q, 7, 100, 0)
+    assert p == ecm_curve(p * q, 7, 100, 10000)
+    assert p == ecm_curve(p * q, 13, 100, 0)
+    assert ecm(p * q, 2000) in [p, q]
+    assert (2**31 - 1) == ecm_factor((2**31 - 1)**2)
+
+def test_montgomery_multiply():
+    p = 1000003
+    X, Z, a24 = suyama_curve(17, p)
+    X1, Z1 = montgomery_multiply(6 * 35, X, Z, a24, p)
+    X2, Z2 = montgomery_multiply(6, X, Z, a24, p)
+    X2, Z2 = montgomery_multiply(35, X2, Z2, a24, p)
+    assert X1 * Z2 % p == X2 * Z1 % p
+
+def test_factor_in_parallel():
+    p = 1000000007
+    q = 10**19 + 51
+    assert [(2, 3), (p, 2), (q, 1)] == factor(8 * p * p * q, workers=2)
+    failure = raises(RuntimeError, factor, (2**61 - 1) * (2**89 - 1),
+                     workers=2, timeout=0.01)
+    assert str(failure.value).startswith("Timed out")
+
+def test_factorization():
+    n = (2**61 - 1) * (2**31 - 1) * 1000003**2
+    F = factorization(n)
+    assert F is factorization(n)
+    assert F is factorization(F)
+    assert n == F.n and [1000003, 2**31 - 1, 2**61 - 1] == F.primes
+    assert F == Factorization(reversed(F))
+    assert [(2, 2), (3, 1), (167, 1)] == list(factorization(2004))
+    assert [] == list(factorization(1))
+    raises(ValueError, factorization, 0)
+    assert totient(n) == totient(F)
+    assert totient(F) == (2**61 - 2) * (2**31 - 2) * 1000002 * 1000003
+    assert modular_order(F) == modular_order(n)
+    assert 4 == modular_order(2**4) and 2 == modular_order(24)
+    assert divisors(F) == divisors(n) and 12 == len(divisors(F))
+    assert is_primitive_root(3, Factorization([(7, 1)]))
+    assert not is_primitive_root(2, factorization(7))
+    assert not is_primitive_root(3, F)
+    assert 31 == primitive_root(factorization(5881))
+    assert -1 == legendre(7, factorization(2003))
+
+def test_find_one_prime_factor():
+    p = 1000000007
+    q = 10**19 + 51
+    assert p == find_one_prime_factor(p * q * q)
+
+def test_batch_inverse():
+    assert [] == batch_inverse([], 7)
+    assert [4, 5, 2] == batch_inverse([2, 3, 4], 7)
+    values = range(1, 1000)
+    assert [inversemod(v, 1009) for v in values] == \
+           batch_inverse(values, 1009)
+    error = raises(ZeroDivisionError, batch_inverse, [2, 10, 7, 4], 35)
+    assert (10, 35) == error.value.args
 
 def test_gcd():
     assert 1 == gcd(97, 100)
     assert 97 == gcd(97 * 10**15, 19**20 * 97**2)              # (2)
+    assert 5 == gcd(0, -5) == gcd(-5, 0) == gcd(-10, 15)
+    assert 0 == gcd(0, 0)
+    # Deep enough to take Lehmer steps, and to overflow the old recursion.
+    p = 2**4253 - 1
+    a = p * 3**4000
+    b = p * 5**3000
+    assert p == gcd(a, b) == gcd(b, a)
+    g, x, y = xgcd(a, -b)
+    assert g == p and g == x * a - y * b
+    fibonacci = [1, 1]
+    while fibonacci[-1].bit_length() < 5000:
+        fibonacci.append(fibonacci[-1] + fibonacci[-2])
+    assert 1 == gcd(fibonacci[-1], fibonacci[-2])
+    for a, b in [(2, 3), (10, 12), (100, 2004), (-7, 3), (0, -4), (240, 46)]:
+        g, x, y = xgcd(a, b)
+        assert g == gcd(a, b) == x * a + y * b
+    assert 6 == gcd_many([12, 18, -30])
+    assert 0 == gcd_many([])
+    assert 1 == gcd_many(iter([2, 3] + [None]))
+    assert 60 == lcm_many([4, 6, -10])
+    assert 0 == lcm_many([4, 0])
+
+def test_batch_gcd(tmpdir):
+    assert [] == batch_gcd([])
+    assert [1, 7, 11, 77] == batch_gcd([6, 35, 11, 77])
+    p, q, r = 2**521 - 1, 2**607 - 1, 2**1279 - 1
+    moduli = [p * q, q * r, (2**61 - 1) * (2**89 - 1), p * r, 101 * 103]
+    assert [p * q, q * r, 1, p * r, 1] == batch_gcd(moduli)
+    directory = str(tmpdir)
+    assert batch_gcd(moduli) == list(batch_gcd_on_disk(iter(moduli),
+                                                       directory))
+    assert [] == list(batch_gcd_on_disk([], directory))
+    assert [1] == list(batch_gcd_on_disk([15], directory))
+    assert [] == tmpdir.listdir()
+    for m in [2**20000 + 1, random.getrandbits(17000) | 1, 3**11000]:
+        assert abs(_reciprocal(m, 60000) - (1 << 60000) / m) < 4
+    numbers = [random.getrandbits(64) | 1 for _ in range(201)]
+    assert [gcd(n, reduce(mul, numbers[:i] + numbers[i + 1:]))
+            for i, n in enumerate(numbers)] == batch_gcd(numbers)
+
+def test_is_prime():
+    wanted = set(primes(20000))
+    assert wanted == set(n for n in xrange(-5, 20000) if is_prime(n))
+    for carmichael in [561, 41041, 825265, 321197185]:
+        assert not is_prime(carmichael)
+    assert not is_prime(3215031751)
+    assert not is_prime(3825123056546413051)   # spsp to bases 2 to 23
+    assert is_prime(2**61 - 1)
+    assert is_prime(2**89 - 1)
+    assert is_prime(2**127 - 1)
+    assert not is_prime((2**61 - 1) * (2**89 - 1))
+    assert not is_prime((2**64 + 13) ** 2)
+
+def test_jacobi():
+    for n in [3, 5, 7, 11, 13, 97]:
+        for a in range(-n, 2 * n):
+            assert legendre(a, n) == jacobi(a, n)
+    assert 1 == jacobi(2, 15)      # yet 2 is not a square mod 15
+    assert 0 == jacobi(6, 15)
+
+def test_sqrtmod():
+    for p in [3, 5, 13, 17, 41, 97, 193, 257, 7681, 65537]:
+        squares = [a for a in xrange(min(p, 2000)) if jacobi(a, p) == 1]
+        for a, root in zip(squares, sqrtmod_many(squares, p)):
+            assert a == root * root % p == sqrtmod(a, p)**2 % p
+        assert jacobi(quadratic_non_residue(p), p) == -1
+    p = 2**64 - 2**32 + 1                # p - 1 = 2**32 * (2**32 - 1)
+    assert 7 == quadratic_non_residue(p)
+    assert 1234567**2 % p == sqrtmod(1234567**2, p)**2 % p
+    raises(AssertionError, sqrtmod, 2, 5)
+    recent = [q for q in primes(10000) if q % 4 == 1]
+    for q in recent[-2 * SQRT_PARAMETER_CACHE_SIZE:]:
+        assert 16 == sqrtmod(16, q)**2 % q
+    assert SQRT_PARAMETER_CACHE_SIZE == len(_sqrt_parameters)
+    assert q == next(reversed(_sqrt_parameters))
+
+def test_kronecker():
+    def by_definition(a, n):
+        if n == 0:
+            return int(abs(a) == 1)
+        result = -1 if n < 0 and a < 0 else 1
+        for q, e in prime_factorization(abs(n)):
+            if q == 2:
+                symbol = 0 if a % 2 == 0 else (1 if a % 8 in (1, 7) else -1)
+            else:
+                symbol = legendre(a, q)
+            result *= symbol**e
+        return result
+    for n in range(-40, 41):
+        for a in range(-20, 21):
+            assert by_definition(a, n) == kronecker(a, n)
+    n = 3 * 5 * 7 * 11 * 13
+    assert [jacobi(a, n) for a in range(-n, n)] == jacobi_many(range(-n, n), n)
+    p = 2**127 - 1
+    for a in [2, 3, 5, 7, p - 1, 3**80]:
+        assert pow(a, (p - 1) / 2, p) == legendre(a, p) % p
+
+def test_strong_lucas_pseudoprimes():
+    for n in [5459, 5777, 10877, 16109, 18971, 22499]:
+        assert _is_strong_lucas_pseudoprime(n)
+        assert not is_prime(n)
+    for n in primes(2000)[1:]:
+        assert _is_strong_lucas_pseudoprime(n)
+
+def test_pollard_rho():
+    assert pollard_rho(101 * 103) in [101, 103]
+    n = (2**31 - 1) * (2**61 - 1)
+    assert pollard_rho(n) in [2**31 - 1, 2**61 - 1]
+    assert 2 == pollard_rho(2**20)
+
+def test_prime_factors():
+    assert [] == prime_factors(1)
+    assert [2, 2, 3] == prime_factors(12)
+    assert [2**31 - 1, 2**61 - 1] == prime_factors((2**31 - 1) * (2**61 - 1))
+    assert [1000003, 1000033, 1000037] == \
+           prime_factors(1000003 * 1000033 * 1000037)
+    assert [3, 3, 1000003, 1000003] == prime_factors(9 * 1000003**2)
+
+def test_modular_exponentiation():
+    modulus = 2**127 - 1
+    multiply = lambda x, y: x * y % modulus
+    for exponent in [0, 1, 2, 3, 255, 256, 12345, 2**126 + 2**65 + 17]:
+        expected = pow(7, exponent, modulus)
+        assert expected == powermod(7, exponent, modulus)
+        assert expected == modular_power(7, exponent, modulus)
+        assert expected == sliding_window_power(7, exponent, multiply)
+        assert expected == sliding_window_power(7, exponent, multiply,
+                                                width=1)
+        assert expected == FixedBasePower(7, modulus)(exponent)
+        assert expected * pow(5, exponent + 3, modulus) % modulus == \
+               multi_powermod([7, 5], [exponent, exponent + 3], modulus)
+    assert pow(2, 100, 1001) == FixedBasePower(2, 1001, width=3)(100)
+    assert 3 == modular_power(2, -1, 5)
+    assert pow(2, 2**80, 1000) == FixedBasePower(2, 1000)(2**80)
 
 def test_power_of_factor():
     assert 0 == power_of_factor(3, 2)
@@ -868,10 +3316,61 @@ def test_prime_factorization():
     assert [] == prime_factorization(1)
     assert [(2, 2), (3, 1), (167, 1)] == prime_factorization(2004)
 
+def test_integer_sqrt():
+    assert [0, 1, 1, 1, 2, 2] == [integer_sqrt(n) for n in range(6)]
+    assert 10**20 == integer_sqrt(10**40)
+    assert 10**20 - 1 == integer_sqrt(10**40 - 1)
+    raises(ValueError, integer_sqrt, -1)
+
+def test_iter_primes():
+    assert [] == list(iter_primes(1))
+    assert [2] == list(iter_primes(2))
+    assert [11, 13, 17, 19, 23, 29] == list(iter_primes(30, 10))
+    assert [2, 3, 5] == list(iter_primes(5, -10))
+    # Cross several segment boundaries, checking against a single sieve.
+    start = 10**6 + 1
+    stop = start + 5 * SIEVE_SEGMENT_SIZE
+    wanted = [p for p in _odd_primes(stop) if p >= start]
+    assert wanted == list(iter_primes(stop, start))
+    unbounded = iter_primes()
+    assert [2, 3, 5, 7, 11] == [next(unbounded) for _ in range(5)]
+
+def test_prime_array():
+    found = prime_array(10**6)
+    assert 78498 == len(found)
+    assert 999983 == found[-1]
+    assert int is type(found[-1])
+
+def test_prime_table(tmpdir):
+    table = PrimeTable()
+    assert [2, 3, 5, 7] == list(table.up_to(10))
+    assert 10 <= table.bound
+    assert 25 == len(list(table.up_to(100)))
+    path = str(tmpdir.join("cache", "primes.bin"))
+    table.save(path)
+    loaded = PrimeTable()
+    loaded.load(path)
+    assert table.bound == loaded.bound
+    assert table.primes == loaded.primes
+    capped = PrimeTable(limit=50)
+    assert primes(200) == list(capped.up_to(200))
+    assert 50 == capped.bound
+
 def test_primes():
+    assert [] == primes(1)
     assert [2, 3, 5, 7] == primes(10)
     wanted = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43]
     assert wanted == primes(45)
+    assert 1229 == len(primes(10**4))
+
+def test_range_functions():
+    assert [1, 1, 2, 2, 4, 2, 6, 4, 6, 4] == list(totient_range(1, 11))
+    assert [4, 10, 4] == list(totient_range(10, 13))
+    assert [1, 2, 2, 3, 2, 4, 2, 4, 3, 4] == list(divisor_count_range(1, 11))
+    assert [1, 3, 4, 7, 6, 12, 8, 15, 13, 18] == \
+           list(divisor_sum_range(1, 11))
+    assert 504 == divisor_sum_range(220, 221)[0]
+    assert 12 == divisor_count_range(220, 221)[0]
 
 def test_trial_division():
     assert 3 == trial_division(15)
@@ -879,3 +3378,5 @@ def test_trial_division():
     assert 11 == trial_division(11)
     assert 387833 == trial_division(387833, 300)
     assert 389 == trial_division(387833, 400)
+    for n in [0, -4, -7]:
+        raises(ValueError, trial_division, n)